@@ -0,0 +1,86 @@
+"""证件照背景分割与替换
+
+在长边为 PROXY_LONG_SIDE 的代理图上，用 NumPy 按与边框颜色的距离找出候选
+背景，再只保留从上、左、右边框连通过来的部分，避免衣服、头发中颜色相近的
+区域被误替换。导出时掩码按输出尺寸放大并羽化，再与规格的 bg_color 合成。
+"""
+import numpy as np
+from PIL import Image, ImageFilter
+
+# 分割使用的代理图长边（像素）
+PROXY_LONG_SIDE = 256
+
+# 与背景参考色的最小颜色距离阈值（RGB 欧氏距离）
+COLOR_DISTANCE = 40
+
+# 颜色距离阈值的上限，避免背景杂乱时把人物也当成背景
+MAX_COLOR_DISTANCE = 60
+
+
+def _spread_rows(reached, candidate):
+    """把已到达的像素沿行方向扩展到同一段连续的候选像素"""
+    flat = candidate.ravel()
+    starts = flat.copy()
+    starts[1:] &= ~flat[:-1]
+    starts[::candidate.shape[1]] = flat[::candidate.shape[1]]  # 每行重新开始
+    run_ids = np.cumsum(starts) * flat  # 非候选像素为 0
+
+    hit = np.zeros(np.count_nonzero(starts) + 1, dtype=bool)
+    hit[run_ids[reached.ravel()]] = True
+    hit[0] = False
+    return hit[run_ids].reshape(candidate.shape)
+
+
+def background_mask(image):
+    """分割背景，返回代理分辨率的 L 模式掩码，255 为背景"""
+    factor = max(1.0, max(image.size) / PROXY_LONG_SIDE)
+    proxy_size = (max(1, round(image.width / factor)), max(1, round(image.height / factor)))
+    proxy = image.convert("RGB").resize(proxy_size, Image.Resampling.BOX, reducing_gap=2.0)
+    rgb = np.asarray(proxy, dtype=np.float32)
+
+    # 参考色取上、左、右边框的中位数，底边通常是肩膀
+    border = np.concatenate([rgb[0], rgb[:, 0], rgb[:, -1]])
+    reference = np.median(border, axis=0)
+    distance = np.sqrt(((rgb - reference) ** 2).sum(axis=2))
+
+    # 墙面有明暗渐变时按边框本身的离散程度放宽阈值
+    border_distance = np.sqrt(((border - reference) ** 2).sum(axis=1))
+    threshold = min(MAX_COLOR_DISTANCE, max(COLOR_DISTANCE, 2 * np.percentile(border_distance, 80)))
+    candidate = distance < threshold
+
+    # 从边框出发，交替按行、按列扩展连通区域，直到不再变化
+    reached = np.zeros_like(candidate)
+    reached[0] = candidate[0]
+    reached[:, 0] = candidate[:, 0]
+    reached[:, -1] = candidate[:, -1]
+    while True:
+        grown = _spread_rows(reached, candidate)
+        grown = _spread_rows(grown.T, candidate.T).T
+        if np.array_equal(grown, reached):
+            break
+        reached = grown
+
+    mask = Image.fromarray(reached.astype(np.uint8) * 255, "L")
+    # 去掉孤立的噪点
+    return mask.filter(ImageFilter.MedianFilter(3))
+
+
+def feather_mask(mask, upscale):
+    """放大后的掩码按放大倍数羽化，消除代理图的锯齿"""
+    if upscale <= 1:
+        return mask
+    return mask.filter(ImageFilter.GaussianBlur(upscale / 2))
+
+
+def composite_background(image, mask, bg_color):
+    """把 image 中掩码为背景的部分替换为 bg_color，mask 与 image 尺寸相同"""
+    return Image.composite(Image.new(image.mode, image.size, bg_color), image, mask)
+
+
+def replace_background(image, bg_color, mask=None):
+    """整张图片的背景替换，mask 默认为 background_mask(image)"""
+    if mask is None:
+        mask = background_mask(image)
+    upscale = image.width / mask.width
+    mask = feather_mask(mask.resize(image.size, Image.Resampling.BILINEAR), upscale)
+    return composite_background(image.convert("RGB"), mask, bg_color)
@@ -0,0 +1,377 @@
+"""批量处理证件照
+
+读取清单（CSV 或 JSON），按每行的规格、缩放、偏移和亮度/对比度参数裁剪照片，
+可选地生成打印排版，用进程池并行处理。
+
+清单字段：
+    input       原图路径（相对路径以清单所在目录为准）
+    spec        PhotoConfig.SPECIFICATIONS 中的规格名
+    scale       缩放比例，默认 1.0
+    offset_x    图片中心在编辑画布上的横坐标，默认画布中心
+    offset_y    图片中心在编辑画布上的纵坐标，默认画布中心
+    brightness  亮度，默认 1.0
+    contrast    对比度，默认 1.0
+    auto        填写 1/true/yes 时检测人脸，自动计算 scale 和 offset（需要 OpenCV）
+    replace_background  填写 1/true/yes 时把背景替换为规格的 bg_color
+    profile     PhotoConfig.EXPORT_PROFILES 中的导出配置名（可选，默认使用 --profile），
+                决定照片的格式、压缩参数和文件大小限制
+    output      输出文件名（可选），扩展名需要与导出配置的格式一致；默认使用原图
+                文件名，同一原图出现在多行时加上行号（从 1 开始），如 a_2.jpg。
+                多行的输出文件名相同时这些行都按失败处理
+    paper       PhotoConfig.PAPER_SIZES 中的纸张名（可选，填写时同时生成排版）
+    copies      排版中的照片数量，默认排满一张纸；超过一张纸的容量时输出多张
+    dpi         排版的输出 DPI，默认使用纸张配置
+    sheet       排版分组名（可选），同组的行不论规格都排在同一组打印纸上，
+                纸张和 DPI 取组内第一行，copies 默认为 1
+
+指定 --cache-dir 时，裁剪结果按原图内容和参数缓存，排版按裁剪结果和排版参数
+缓存，重新运行清单时未改变的行直接复制缓存的文件。
+
+用法：
+    python batch_process.py manifest.csv --output-dir out --workers 8 --sheet-format tif
+    python batch_process.py manifest.csv --cache-dir ~/.cache/id_photos
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+
+from photo_configs import PhotoConfig
+from photo_core import (
+    CANVAS_SIZE,
+    auto_fit,
+    crop_photo,
+    load_source_image,
+    save_sheet,
+)
+from background import background_mask
+from face_locator import locate_face
+from export_profiles import encode_image, export_profile, profile_extension
+from result_cache import ResultCache, file_digest
+from sheet_packing import SheetPacker
+
+
+def read_manifest(manifest_path):
+    """读取清单，返回每一行参数组成的字典列表"""
+    if manifest_path.lower().endswith(".json"):
+        with open(manifest_path, encoding="utf-8") as f:
+            entries = json.load(f)
+    else:
+        with open(manifest_path, newline="", encoding="utf-8-sig") as f:
+            entries = list(csv.DictReader(f))
+
+    # 相对路径以清单所在目录为准
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    for entry in entries:
+        entry["input"] = os.path.join(base_dir, entry.get("input") or "")
+    return entries
+
+
+def _flag(entry, key):
+    """读取开关字段，1/true/yes 视为开启"""
+    return str(entry.get(key) or "").strip().lower() in ("1", "true", "yes")
+
+
+def _number(entry, key, default):
+    """读取数值字段，CSV 中的空字符串视为未填写"""
+    value = entry.get(key)
+    if value is None or value == "":
+        return default
+    return float(value)
+
+
+def _paper(entry):
+    if entry["paper"] not in PhotoConfig.PAPER_SIZES:
+        raise ValueError(f"Unknown paper size: {entry['paper']}")
+    return PhotoConfig.PAPER_SIZES[entry["paper"]]
+
+
+def save_packed_sheets(base_path, paper_size, items, dpi, sheet_format="jpg",
+                       cut_margin_mm=PhotoConfig.PRINT_CUT_MARGIN_MM,
+                       memory_budget_mb=PhotoConfig.SHEET_MEMORY_BUDGET_MB,
+                       cache=None, items_key=None):
+    """把 (照片, 规格, 数量) 排到打印纸上并保存，返回生成的文件路径列表
+
+    只有一张纸时保存为 {base_path}.{格式}，多张时依次编号。给出 cache 和代表
+    items 内容的 items_key 时，每张纸的合成结果都经过缓存。
+    """
+    sheets = SheetPacker(paper_size, cut_margin_mm).pack(items)
+    outputs = []
+    for number, placements in enumerate(sheets, 1):
+        suffix = f"_{number}" if len(sheets) > 1 else ""
+        sheet_path = f"{base_path}{suffix}.{sheet_format}"
+        outputs.append(sheet_path)
+
+        key = None
+        if cache is not None and items_key:
+            key = ResultCache.key("sheet", items_key, paper_size, dpi, cut_margin_mm,
+                                  sheet_format, number)
+            if cache.fetch(key, sheet_path):
+                continue
+        save_sheet(sheet_path, paper_size, placements, dpi, memory_budget_mb)
+        if key:
+            cache.store(key, sheet_path)
+    return outputs
+
+
+def sheet_items_key(photo_paths, specs, copies):
+    """由裁剪结果文件的内容、规格和数量计算排版内容的缓存键"""
+    return ResultCache.key([
+        (file_digest(path), spec, count) for path, spec, count in zip(photo_paths, specs, copies)
+    ])
+
+
+def crop_entry(entry, source):
+    """按一行参数裁剪已经打开的原图，返回 (成品照片, 规格)"""
+    if entry.get("spec") not in PhotoConfig.SPECIFICATIONS:
+        raise ValueError(f"Unknown spec: {entry.get('spec')}")
+    spec = PhotoConfig.SPECIFICATIONS[entry["spec"]]
+    scale = _number(entry, "scale", 1.0)
+    offset = (
+        _number(entry, "offset_x", CANVAS_SIZE[0] // 2),
+        _number(entry, "offset_y", CANVAS_SIZE[1] // 2),
+    )
+    brightness = _number(entry, "brightness", 1.0)
+    contrast = _number(entry, "contrast", 1.0)
+
+    if _flag(entry, "auto"):
+        landmarks = locate_face(source)
+        if landmarks is None:
+            raise ValueError("No face detected")
+        scale, offset = auto_fit(landmarks, spec, source.size, CANVAS_SIZE)
+
+    mask = background_mask(source) if _flag(entry, "replace_background") else None
+    return crop_photo(source, spec, scale, offset, brightness, contrast, mask=mask), spec
+
+
+def crop_key(entry, source_digest, profile):
+    """裁剪结果的缓存键，数值按解析后的值计算，CSV 和 JSON 清单共用缓存"""
+    spec_name = entry.get("spec")
+    return ResultCache.key(
+        "crop",
+        source_digest,
+        spec_name,
+        PhotoConfig.SPECIFICATIONS.get(spec_name),
+        _number(entry, "scale", 1.0),
+        _number(entry, "offset_x", CANVAS_SIZE[0] // 2),
+        _number(entry, "offset_y", CANVAS_SIZE[1] // 2),
+        _number(entry, "brightness", 1.0),
+        _number(entry, "contrast", 1.0),
+        _flag(entry, "auto"),
+        _flag(entry, "replace_background"),
+        profile,
+    )
+
+
+def sheet_options(entry, spec, cut_margin_mm=PhotoConfig.PRINT_CUT_MARGIN_MM):
+    """读取一行的排版参数，返回 (纸张, 照片数量, DPI)，数量默认排满一张纸"""
+    paper_size = _paper(entry)
+    copies = int(_number(entry, "copies",
+                         PhotoConfig.CATALOG.sheet_capacity(paper_size, spec, cut_margin_mm)))
+    dpi = int(_number(entry, "dpi", paper_size["dpi"]))
+    return paper_size, copies, dpi
+
+
+def output_names(entries, profile_name=None):
+    """每行照片的输出文件名，导出配置未知的行为 None（由 process_entry 报错）
+
+    未填写 output 的行使用原图文件名，同一原图出现在多行时（同一张照片做
+    多种规格）加上行号，避免多个工作进程写同一个文件。
+    """
+    defaults = []
+    for entry in entries:
+        stem = os.path.splitext(os.path.basename(entry["input"]))[0]
+        try:
+            extension = profile_extension(export_profile(entry.get("profile") or profile_name))
+        except ValueError:
+            extension = None
+        defaults.append((stem, extension))
+
+    shared = Counter(default for entry, default in zip(entries, defaults)
+                     if not entry.get("output"))
+    names = []
+    for row, (entry, (stem, extension)) in enumerate(zip(entries, defaults), 1):
+        if entry.get("output"):
+            names.append(entry["output"])
+        elif extension is None:
+            names.append(None)
+        elif shared[stem, extension] > 1:
+            names.append(f"{stem}_{row}{extension}")
+        else:
+            names.append(f"{stem}{extension}")
+    return names
+
+
+def process_entry(entry, output_dir, sheet_format="jpg",
+                  memory_budget_mb=PhotoConfig.SHEET_MEMORY_BUDGET_MB,
+                  cut_margin_mm=PhotoConfig.PRINT_CUT_MARGIN_MM, cache=None,
+                  profile_name=None, name=None):
+    """处理清单中的一行，返回生成的文件路径列表，第一个为裁剪后的照片
+
+    name 为照片的输出文件名，默认取 output 字段或原图文件名。
+    """
+    if entry.get("spec") not in PhotoConfig.SPECIFICATIONS:
+        raise ValueError(f"Unknown spec: {entry.get('spec')}")
+    spec = PhotoConfig.SPECIFICATIONS[entry["spec"]]
+    profile = export_profile(entry.get("profile") or profile_name)
+
+    stem = os.path.splitext(os.path.basename(entry["input"]))[0]
+    name = name or entry.get("output") or f"{stem}{profile_extension(profile)}"
+    if Image.registered_extensions().get(os.path.splitext(name)[1].lower()) != profile["format"]:
+        raise ValueError(f"Output {name} does not match the {profile['format']} export profile")
+    photo_path = os.path.join(output_dir, name)
+    outputs = [photo_path]
+
+    key = None
+    if cache is not None:
+        key = crop_key(entry, file_digest(entry["input"]), profile)
+    if key and cache.fetch(key, photo_path):
+        # 命中缓存时只在需要排版时才解码照片
+        photo = Image.open(photo_path)
+    else:
+        photo, spec = crop_entry(entry, load_source_image(entry["input"]))
+        # 先编码再写文件，不满足大小限制时不留下空文件
+        data = encode_image(photo, profile, spec["dpi"])
+        with open(photo_path, "wb") as f:
+            f.write(data)
+        if key:
+            cache.store(key, photo_path)
+
+    # 可选的打印排版，分组的行在全部裁剪完成后统一排版
+    if entry.get("paper") and not entry.get("sheet"):
+        paper_size, copies, dpi = sheet_options(entry, spec, cut_margin_mm)
+        items_key = sheet_items_key([photo_path], [spec], [copies]) if cache is not None else None
+        outputs += save_packed_sheets(
+            f"{os.path.splitext(photo_path)[0]}_sheet", paper_size,
+            [(photo, spec, copies)], dpi, sheet_format, cut_margin_mm, memory_budget_mb,
+            cache, items_key
+        )
+
+    return outputs
+
+
+def process_sheet_group(name, entries, photo_paths, output_dir, sheet_format="jpg",
+                        memory_budget_mb=PhotoConfig.SHEET_MEMORY_BUDGET_MB,
+                        cut_margin_mm=PhotoConfig.PRINT_CUT_MARGIN_MM, cache=None):
+    """把同一分组中已裁剪好的照片混排到打印纸上，返回生成的文件路径列表"""
+    paper_size = _paper(entries[0])
+    dpi = int(_number(entries[0], "dpi", paper_size["dpi"]))
+    items = [
+        (Image.open(path), PhotoConfig.SPECIFICATIONS[entry["spec"]],
+         int(_number(entry, "copies", 1)))
+        for entry, path in zip(entries, photo_paths)
+    ]
+    items_key = None
+    if cache is not None:
+        items_key = sheet_items_key(photo_paths, [spec for _, spec, _ in items],
+                                    [copies for _, _, copies in items])
+    return save_packed_sheets(
+        os.path.join(output_dir, f"{name}_sheet"), paper_size, items, dpi,
+        sheet_format, cut_margin_mm, memory_budget_mb, cache, items_key
+    )
+
+
+def run_batch(entries, output_dir, workers=None, sheet_format="jpg",
+              memory_budget_mb=PhotoConfig.SHEET_MEMORY_BUDGET_MB,
+              cut_margin_mm=PhotoConfig.PRINT_CUT_MARGIN_MM, cache=None, profile_name=None):
+    """用进程池处理所有条目，单个文件失败不影响其它文件，返回失败数量"""
+    os.makedirs(output_dir, exist_ok=True)
+    failures = 0
+    sheet_failures = 0
+    started = time.perf_counter()
+    groups = {}
+
+    # 输出文件名相同的行会在不同的工作进程中互相覆盖，提交前直接判为失败
+    names = output_names(entries, profile_name)
+    counts = Counter(os.path.normcase(name) for name in names if name)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for entry, name in zip(entries, names):
+            if name and counts[os.path.normcase(name)] > 1:
+                failures += 1
+                print(f"FAILED {entry['input']}: Output {name} is also written by another row",
+                      file=sys.stderr)
+                continue
+            futures[executor.submit(process_entry, entry, output_dir, sheet_format,
+                                    memory_budget_mb, cut_margin_mm, cache, profile_name,
+                                    name)] = entry
+        for future in as_completed(futures):
+            entry = futures[future]
+            try:
+                outputs = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"FAILED {entry['input']}: {e}", file=sys.stderr)
+            else:
+                print(f"OK     {entry['input']} -> {', '.join(outputs)}")
+                if entry.get("sheet") and entry.get("paper"):
+                    groups.setdefault(entry["sheet"], []).append((entry, outputs[0]))
+
+        # 分组排版，组内保持清单中的顺序
+        order = {id(entry): i for i, entry in enumerate(entries)}
+        sheet_futures = {}
+        for name, members in groups.items():
+            members.sort(key=lambda member: order[id(member[0])])
+            sheet_futures[executor.submit(
+                process_sheet_group, name,
+                [entry for entry, _ in members], [path for _, path in members],
+                output_dir, sheet_format, memory_budget_mb, cut_margin_mm, cache
+            )] = name
+        for future in as_completed(sheet_futures):
+            name = sheet_futures[future]
+            try:
+                outputs = future.result()
+            except Exception as e:
+                failures += 1
+                sheet_failures += 1
+                print(f"FAILED sheet {name}: {e}", file=sys.stderr)
+            else:
+                print(f"OK     sheet {name} -> {', '.join(outputs)}")
+
+    elapsed = time.perf_counter() - started
+    done = len(entries) - failures + sheet_failures
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f"Processed {done}/{len(entries)} files in {elapsed:.2f}s "
+          f"({rate:.2f} files/s), {failures} failed")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch crop ID photos from a manifest")
+    parser.add_argument("manifest", help="CSV or JSON manifest")
+    parser.add_argument("--output-dir", default="output", help="directory for rendered files")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument("--sheet-format", choices=["jpg", "tif"], default="jpg",
+                        help="print sheet format; tif is written in strips for large sheets")
+    parser.add_argument("--memory-budget-mb", type=int,
+                        default=PhotoConfig.SHEET_MEMORY_BUDGET_MB,
+                        help="memory budget per print sheet in MB")
+    parser.add_argument("--cut-margin-mm", type=float,
+                        default=PhotoConfig.PRINT_CUT_MARGIN_MM,
+                        help="gap between photos on print sheets, in mm")
+    parser.add_argument("--profile", choices=list(PhotoConfig.EXPORT_PROFILES),
+                        default=PhotoConfig.DEFAULT_EXPORT_PROFILE,
+                        help="export profile for rows without a profile field")
+    parser.add_argument("--cache-dir", help="reuse rendered photos and sheets from this directory")
+    parser.add_argument("--cache-mb", type=int, default=PhotoConfig.RESULT_CACHE_MB,
+                        help="maximum size of the result cache in MB")
+    args = parser.parse_args(argv)
+
+    entries = read_manifest(args.manifest)
+    cache = ResultCache(args.cache_dir, args.cache_mb) if args.cache_dir else None
+    failures = run_batch(entries, args.output_dir, args.workers,
+                         args.sheet_format, args.memory_budget_mb, args.cut_margin_mm, cache,
+                         args.profile)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""图像处理热点路径的基准测试
+
+不需要显示器。用合成的 2~50 MP 原图，对每种规格和每种纸张依次运行编辑器
+各个操作对应的函数，记录每个阶段的耗时、峰值内存（RSS）和 Pillow 的图像
+分配次数，结果写成 JSON，可以与之前的结果比较。
+
+阶段与界面操作的对应关系：
+    load            upload_image（按预览尺寸快速解码）
+    show_image      show_image（金字塔取级 + 只渲染视口）
+    adjustments     update_adjustments（查找表 + 作用于视口缓冲图）
+    full_decode     get_cropped_photo 中的完整解码
+    crop            get_cropped_photo（一次重采样到成品尺寸）
+    save_photo      save_cropped_image（JPEG 编码）
+    print_preview   PrintPreviewWindow.create_preview
+    save_sheet      save_print_layout
+
+用法：
+    python benchmark.py --sizes 2,8,20,50 --output results.json --compare baseline.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+from PIL import Image, __version__ as PILLOW_VERSION
+
+from photo_configs import PhotoConfig
+from photo_core import (
+    CANVAS_SIZE,
+    ImagePyramid,
+    PrintLayout,
+    SourceImage,
+    adjustment_lut,
+    apply_lut,
+    render_crop,
+    render_viewport,
+    save_sheet,
+    sheet_pixel_size,
+    spec_pixel_size,
+)
+
+DEFAULT_SIZES_MP = [2, 8, 20, 50]
+
+# 合成原图的宽高比（竖版 3:4，与常见的人像照片一致）
+ASPECT = (3, 4)
+
+
+def reset_peak_rss():
+    """Linux 上重置进程的峰值 RSS，其它系统上峰值只能单调增长"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss 在 Linux 上以 KB 为单位，在 macOS 上以字节为单位
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def measure(results, stage, context, func, *args, repeat=1):
+    """运行一个阶段 repeat 次，记录最短耗时、峰值 RSS 和 Pillow 分配统计"""
+    best = None
+    for _ in range(repeat):
+        reset_peak_rss()
+        before = Image.core.get_stats()
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+        after = Image.core.get_stats()
+        best = elapsed if best is None else min(best, elapsed)
+    results.append(dict(
+        context,
+        stage=stage,
+        wall_s=round(best, 6),
+        peak_rss_mb=round(peak_rss_mb(), 1),
+        images_created=after["new_count"] - before["new_count"],
+        blocks_allocated=after["allocated_blocks"] - before["allocated_blocks"],
+        blocks_reused=after["reused_blocks"] - before["reused_blocks"],
+    ))
+    return result
+
+
+def synthetic_source(path, megapixels):
+    """生成指定像素数的合成人像原图并保存为 JPEG"""
+    unit = (megapixels * 1_000_000 / (ASPECT[0] * ASPECT[1])) ** 0.5
+    size = (int(unit * ASPECT[0]), int(unit * ASPECT[1]))
+    # 渐变背景加噪声，避免 JPEG 压缩得过于简单
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 40)
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    image.save(path, quality=90)
+    return size
+
+
+def show_image(pyramid, scale, offset):
+    level = pyramid.levels[pyramid.level_index(scale)]
+    return render_viewport(level, scale, offset, CANVAS_SIZE,
+                           Image.Resampling.LANCZOS, full_size=pyramid.full_size)
+
+
+def adjustments(buffer, histogram):
+    lut = adjustment_lut(1.1, 1.1, histogram)
+    return apply_lut(buffer, lut)
+
+
+def full_decode(path):
+    return SourceImage(path).load_full()
+
+
+def crop(image, scale, offset, spec):
+    lut = adjustment_lut(1.1, 1.1, image.histogram())
+    return render_crop(image, scale, offset, CANVAS_SIZE, spec_pixel_size(spec),
+                       spec["bg_color"], lut)
+
+
+def save_photo(photo):
+    buffer = io.BytesIO()
+    photo.save(buffer, "JPEG", quality=95)
+    return buffer.tell()
+
+
+def print_preview(photo, paper_size, spec):
+    # 与 PrintPreviewWindow 相同的缩放比例
+    width_px, height_px = sheet_pixel_size(paper_size)
+    scale = min(0.5, 1050 / width_px, 750 / height_px)
+    preview_scale = width_px * scale / paper_size["width_mm"]
+    preview_size = (round(spec["width_mm"] * preview_scale), round(spec["height_mm"] * preview_scale))
+    layout = PrintLayout(paper_size, spec)
+    return layout.get_placements(photo.resize(preview_size, Image.Resampling.LANCZOS),
+                                 layout.max_photos)
+
+
+def save_print_sheet(path, photo, paper_size, spec):
+    layout = PrintLayout(paper_size, spec)
+    save_sheet(path, paper_size, layout.get_placements(photo, layout.max_photos))
+
+
+def run(sizes_mp, repeat=1):
+    """运行全部阶段，返回结果列表"""
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for megapixels in sizes_mp:
+            path = os.path.join(tmp, f"source_{megapixels}mp.jpg")
+            size = synthetic_source(path, megapixels)
+            context = {"source_mp": megapixels, "source_size": list(size)}
+            print(f"{megapixels} MP source {size[0]}x{size[1]}", file=sys.stderr)
+
+            source = measure(results, "load", context, SourceImage, path, repeat=repeat)
+            pyramid = ImagePyramid(source.preview, source.size)
+            histogram = source.preview.histogram()
+            image = measure(results, "full_decode", context, full_decode, path, repeat=repeat)
+
+            for spec_name, spec in PhotoConfig.SPECIFICATIONS.items():
+                spec_context = dict(context, spec=spec_name)
+                # 让照片短边大致铺满裁剪框
+                target = spec_pixel_size(spec)
+                scale = max(target[0] / size[0], target[1] / size[1]) * 1.2
+                offset = (CANVAS_SIZE[0] // 2, CANVAS_SIZE[1] // 2)
+
+                buffer, _ = measure(results, "show_image", spec_context,
+                                    show_image, pyramid, scale, offset, repeat=repeat)
+                measure(results, "adjustments", spec_context,
+                        adjustments, buffer, histogram, repeat=repeat)
+                photo = measure(results, "crop", spec_context,
+                                crop, image, scale, offset, spec, repeat=repeat)
+                measure(results, "save_photo", spec_context, save_photo, photo, repeat=repeat)
+
+                for paper_name, paper_size in PhotoConfig.PAPER_SIZES.items():
+                    paper_context = dict(spec_context, paper=paper_name)
+                    measure(results, "print_preview", paper_context,
+                            print_preview, photo, paper_size, spec, repeat=repeat)
+                    measure(results, "save_sheet", paper_context,
+                            save_print_sheet, os.path.join(tmp, "sheet.jpg"),
+                            photo, paper_size, spec, repeat=repeat)
+
+            # 释放本轮的原图再生成下一张
+            del source, pyramid, image
+    return results
+
+
+def _key(result):
+    return (result["stage"], result["source_mp"], result.get("spec"), result.get("paper"))
+
+
+def _label(result):
+    return " / ".join(str(part) for part in _key(result) if part is not None)
+
+
+def compare(results, baseline):
+    """打印与基线结果的耗时对比"""
+    previous = {_key(result): result for result in baseline}
+    for result in results:
+        old = previous.get(_key(result))
+        if not old or not old["wall_s"]:
+            continue
+        ratio = result["wall_s"] / old["wall_s"]
+        print(f"{_label(result):60} {old['wall_s'] * 1000:9.1f} ms -> "
+              f"{result['wall_s'] * 1000:9.1f} ms  x{ratio:.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the imaging hot paths")
+    parser.add_argument("--sizes", default=",".join(str(mp) for mp in DEFAULT_SIZES_MP),
+                        help="comma separated source sizes in megapixels")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="runs per stage, the fastest is reported")
+    parser.add_argument("--output", default="benchmark_results.json",
+                        help="JSON file for the results")
+    parser.add_argument("--compare", help="previous results to compare against")
+    args = parser.parse_args(argv)
+
+    sizes_mp = [float(mp) if "." in mp else int(mp) for mp in args.sizes.split(",")]
+    results = run(sizes_mp, args.repeat)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({
+            "python": platform.python_version(),
+            "pillow": PILLOW_VERSION,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results,
+        }, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(results, json.load(f)["results"])
+        return 0
+
+    for result in results:
+        print(f"{_label(result):60} {result['wall_s'] * 1000:9.1f} ms "
+              f"{result['peak_rss_mb']:8.1f} MB {result['images_created']:5d} images")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
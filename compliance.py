@@ -0,0 +1,140 @@
+"""证件照合规检查
+
+在裁剪好的成品照片上测量眼睛高度（距底边）、头部高度（头顶到下巴）和背景
+均匀度，与规格的 guide_lines 及 bg_color 比较，生成通过/不通过的报告。人脸
+定位依赖 face_locator（需要 OpenCV），下巴位置由人脸框估计，头部高度是近似值。
+
+用法：
+    python compliance.py output_dir --spec "P.R.China Passport" --report report.json
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from background import background_mask
+from face_locator import locate_face
+from photo_configs import PhotoConfig
+
+# 背景像素与 bg_color 的平均颜色距离上限（RGB 欧氏距离）
+BACKGROUND_MAX_DISTANCE = 20
+
+# 背景像素颜色距离的标准差上限，超过时认为有阴影或明暗不均
+BACKGROUND_MAX_DEVIATION = 12
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+
+
+def spec_for_size(size):
+    """按成品像素尺寸推断规格名，找不到时返回 None"""
+    return PhotoConfig.CATALOG.spec_for_pixel_size(size)
+
+
+def measure_background(photo, bg_color):
+    """返回背景像素与 bg_color 的 (平均颜色距离, 标准差)，没有背景时返回 None"""
+    mask = background_mask(photo).resize(photo.size, Image.Resampling.NEAREST)
+    selected = np.asarray(mask) > 0
+    if not selected.any():
+        return None
+    rgb = np.asarray(photo.convert("RGB"), dtype=np.float32)[selected]
+    distance = np.sqrt(((rgb - np.asarray(bg_color, dtype=np.float32)) ** 2).sum(axis=1))
+    return float(distance.mean()), float(distance.std())
+
+
+def check_photo(photo, spec):
+    """测量成品照片并与规格比较，返回报告字典"""
+    px_to_mm = 25.4 / spec["dpi"]
+    guide = spec["guide_lines"]
+    report = {"checks": {}}
+
+    landmarks = locate_face(photo)
+    if landmarks is None:
+        report["error"] = "No face detected"
+        report["checks"]["eyes"] = False
+        report["checks"]["head"] = False
+    else:
+        eyes_mm = (photo.height - landmarks["eyes_y"]) * px_to_mm
+        head_mm = (landmarks["chin_y"] - landmarks["crown_y"]) * px_to_mm
+        report["eyes_mm"] = round(eyes_mm, 1)
+        report["head_mm"] = round(head_mm, 1)
+        report["checks"]["eyes"] = guide["eyes_position_min"] <= eyes_mm <= guide["eyes_position_max"]
+        report["checks"]["head"] = guide["head_size_min"] <= head_mm <= guide["head_size_max"]
+
+    background = measure_background(photo, spec["bg_color"])
+    if background is None:
+        report["checks"]["background"] = False
+    else:
+        distance, deviation = background
+        report["background_distance"] = round(distance, 1)
+        report["background_deviation"] = round(deviation, 1)
+        report["checks"]["background"] = (distance <= BACKGROUND_MAX_DISTANCE
+                                          and deviation <= BACKGROUND_MAX_DEVIATION)
+
+    report["passed"] = all(report["checks"].values())
+    return report
+
+
+def check_file(path, spec_name=None):
+    """检查一个文件，spec_name 为空时按像素尺寸推断规格"""
+    with Image.open(path) as image:
+        photo = image.convert("RGB")
+    spec_name = spec_name or spec_for_size(photo.size)
+    if spec_name not in PhotoConfig.SPECIFICATIONS:
+        raise ValueError(f"Cannot determine the spec of a {photo.width}x{photo.height} photo")
+    report = check_photo(photo, PhotoConfig.SPECIFICATIONS[spec_name])
+    report["spec"] = spec_name
+    return report
+
+
+def check_directory(directory, spec_name=None, workers=None):
+    """检查目录中的所有图片，返回 {文件路径: 报告}"""
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    reports = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(check_file, path, spec_name) for path in paths]
+        for path, future in zip(paths, futures):
+            try:
+                reports[path] = future.result()
+            except Exception as e:
+                reports[path] = {"error": str(e), "checks": {}, "passed": False}
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check cropped ID photos against their spec")
+    parser.add_argument("directory", help="directory of cropped photos")
+    parser.add_argument("--spec", choices=list(PhotoConfig.SPECIFICATIONS),
+                        help="spec name (default: inferred from the pixel size)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument("--report", help="write the full report as JSON")
+    args = parser.parse_args(argv)
+
+    reports = check_directory(args.directory, args.spec, args.workers)
+    failures = 0
+    for path, report in reports.items():
+        if report["passed"]:
+            print(f"PASS   {path}")
+            continue
+        failures += 1
+        failed = [name for name, ok in report["checks"].items() if not ok]
+        reason = report.get("error") or f"failed {', '.join(failed)}"
+        print(f"FAIL   {path}: {reason}")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False)
+
+    print(f"{len(reports) - failures}/{len(reports)} photos passed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""编辑历史和渲染缓存
+
+历史只记录参数（规格、缩放、位置、亮度、对比度），不保存任何图像，撤销和
+重做的内存开销与图片大小无关。RenderCache 按参数缓存已经渲染好的视口缓冲图，
+撤销、重做或在两个状态之间来回切换时直接取出显示，不需要重新渲染和调整。
+"""
+from collections import OrderedDict
+
+from photo_core import image_buffer_bytes
+
+
+class EditHistory:
+    """参数状态的撤销/重做栈，状态是可比较的字典"""
+
+    def __init__(self, limit=100):
+        self.limit = limit
+        self.states = []
+        self.index = -1
+
+    @property
+    def current(self):
+        return self.states[self.index] if self.states else None
+
+    def reset(self, state):
+        """打开新图片时清空历史，以 state 作为初始状态"""
+        self.states = [state]
+        self.index = 0
+
+    def push(self, state):
+        """记录新状态，与当前状态相同时忽略；撤销后再编辑会丢弃可重做的状态"""
+        if state == self.current:
+            return False
+        del self.states[self.index + 1:]
+        self.states.append(state)
+        if len(self.states) > self.limit:
+            del self.states[0]
+        self.index = len(self.states) - 1
+        return True
+
+    def undo(self):
+        """返回上一个状态，已经是最早的状态时返回 None"""
+        if self.index <= 0:
+            return None
+        self.index -= 1
+        return self.states[self.index]
+
+    def redo(self):
+        """返回下一个状态，没有可重做的状态时返回 None"""
+        if self.index >= len(self.states) - 1:
+            return None
+        self.index += 1
+        return self.states[self.index]
+
+
+class RenderCache:
+    """按参数缓存渲染结果的 LRU 缓存，总大小不超过 budget_mb"""
+
+    def __init__(self, budget_mb=64):
+        self.budget = budget_mb * 1024 * 1024
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        """返回 (image, position)，没有缓存时返回 None"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, image, position):
+        if key in self.entries:
+            self.size -= image_buffer_bytes(self.entries.pop(key)[0])
+        size = image_buffer_bytes(image)
+        if size > self.budget:
+            return
+        self.entries[key] = (image, position)
+        self.size += size
+        # 超出预算时淘汰最久未使用的结果
+        while self.size > self.budget:
+            _, (old, _) = self.entries.popitem(last=False)
+            self.size -= image_buffer_bytes(old)
+
+    def clear(self):
+        """原图、金字塔或背景掩码变化后，缓存的结果全部失效"""
+        self.entries.clear()
+        self.size = 0
@@ -0,0 +1,114 @@
+"""按导出配置编码照片和打印排版
+
+导出配置见 PhotoConfig.EXPORT_PROFILES。配置了 min_bytes/max_bytes 时，在内存
+中按编码质量二分查找满足大小限制的最高质量，不写临时文件；先尝试配置的质量，
+不满足时最多再编码 log2(100) 次左右。
+"""
+import io
+
+from photo_configs import PhotoConfig
+
+# 文件扩展名，保存对话框和批处理输出文件名使用
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+CONTENT_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+# 可以按质量调整文件大小的格式
+QUALITY_FORMATS = {"JPEG", "WEBP"}
+
+
+def export_profile(name=None):
+    """按名称取导出配置，未指定时使用默认配置"""
+    name = name or PhotoConfig.DEFAULT_EXPORT_PROFILE
+    if name not in PhotoConfig.EXPORT_PROFILES:
+        raise ValueError(f"Unknown export profile: {name}")
+    return PhotoConfig.EXPORT_PROFILES[name]
+
+
+def sheet_profile(profile=None):
+    """打印排版使用的配置，只取导出配置的格式和色度抽样
+
+    min_bytes/max_bytes 是上传单张照片的大小限制，不适用于打印排版；质量使用
+    默认值，DPI 元数据由排版的输出 DPI 决定。
+    """
+    profile = profile or export_profile()
+    return {key: profile[key] for key in ("format", "subsampling") if key in profile}
+
+
+def profile_extension(profile):
+    return EXTENSIONS[profile["format"]]
+
+
+def save_options(profile, dpi=None):
+    """配置对应的 Image.save 参数，不包括 quality"""
+    options = {"format": profile["format"]}
+    dpi = profile.get("dpi") or dpi
+    if dpi:
+        options["dpi"] = (dpi, dpi)
+    for key in ("subsampling", "progressive", "optimize"):
+        if key in profile:
+            options[key] = profile[key]
+    if profile["format"] == "PNG":
+        options.pop("subsampling", None)
+        options.pop("progressive", None)
+    return options
+
+
+def _encode(image, options, quality=None):
+    buffer = io.BytesIO()
+    if quality is None:
+        image.save(buffer, **options)
+    else:
+        image.save(buffer, quality=quality, **options)
+    return buffer.getvalue()
+
+
+def encode_image(image, profile, dpi=None):
+    """按导出配置编码图像，返回字节；无法满足大小限制时抛出 ValueError
+
+    dpi 为写入文件的 DPI 元数据，配置中的 dpi 优先。
+    """
+    options = save_options(profile, dpi)
+    min_bytes = profile.get("min_bytes") or 0
+    max_bytes = profile.get("max_bytes")
+
+    if profile["format"] not in QUALITY_FORMATS:
+        data = _encode(image, options)
+        if len(data) < min_bytes or (max_bytes and len(data) > max_bytes):
+            raise ValueError(f"{profile['format']} output is {len(data)} bytes, "
+                             f"outside the {min_bytes}-{max_bytes} byte limit")
+        return data
+
+    encoded = {}
+
+    def encode(quality):
+        if quality not in encoded:
+            encoded[quality] = _encode(image, options, quality)
+        return encoded[quality]
+
+    def fits(quality):
+        return not max_bytes or len(encode(quality)) <= max_bytes
+
+    quality = profile.get("quality", 95)
+    if fits(quality) and len(encode(quality)) >= min_bytes:
+        return encode(quality)
+
+    # 二分查找不超过上限的最高质量：太大时在更低的质量中找，
+    # 太小时在更高的质量中找（直到 100）
+    if fits(quality):
+        best, low, high = quality, quality + 1, 100
+    else:
+        best, low, high = None, 1, quality - 1
+    while low <= high:
+        middle = (low + high + 1) // 2
+        if fits(middle):
+            best, low = middle, middle + 1
+        else:
+            high = middle - 1
+
+    if best is None:
+        raise ValueError(f"Cannot encode below {max_bytes} bytes even at quality 1")
+    if len(encode(best)) < min_bytes:
+        raise ValueError(f"Output is {len(encode(best))} bytes at quality {best}, "
+                         f"below the {min_bytes} byte minimum")
+    return encode(best)
@@ -0,0 +1,96 @@
+"""人脸和眼睛定位，用于自动调整证件照的缩放和位置
+
+在缩小到 PROXY_LONG_SIDE 的灰度代理图上运行 OpenCV 自带的 Haar 级联检测器，
+只使用 CPU，单张照片耗时通常在 100ms 以内。OpenCV 是可选依赖，只在第一次
+定位时导入；未安装时抛出 RuntimeError。
+"""
+import os
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+# 检测使用的代理图长边（像素）
+PROXY_LONG_SIDE = 400
+
+# 判断头顶时，与背景颜色距离超过该值的像素视为前景
+BACKGROUND_DISTANCE = 40
+
+# Haar 人脸框大致覆盖眉毛到嘴，下巴约在框高的 1.05 倍处
+CHIN_FACTOR = 1.05
+
+# 检测不到眼睛时，按人脸框高度的比例估计眼睛位置
+EYES_FACTOR = 0.42
+
+
+@lru_cache(maxsize=1)
+def _cascades():
+    try:
+        import cv2
+    except ImportError:
+        raise RuntimeError("Auto adjustment requires opencv-python (pip install opencv-python-headless)")
+
+    classifiers = []
+    for name in ("haarcascade_frontalface_default.xml", "haarcascade_eye.xml"):
+        path = os.path.join(cv2.data.haarcascades, name)
+        classifier = cv2.CascadeClassifier(path)
+        if classifier.empty():
+            raise RuntimeError(f"OpenCV cascade not found: {path}")
+        classifiers.append(classifier)
+    return classifiers
+
+
+def _crown(rgb, face):
+    """从人脸框向上寻找头顶：中间一半宽度内的前景像素不足一半的第一行"""
+    x, y, w, _ = face
+    # 背景颜色取最上面几行的中位数
+    background = np.median(rgb[:4].reshape(-1, 3), axis=0)
+    band = rgb[:y, x + w // 4:x + 3 * w // 4].astype(np.int32)
+    distance = np.sqrt(((band - background) ** 2).sum(axis=2))
+    foreground = (distance > BACKGROUND_DISTANCE).mean(axis=1)
+    for row in range(y - 1, -1, -1):
+        if foreground[row] < 0.5:
+            return row + 1
+    return 0
+
+
+def locate_face(image, full_size=None):
+    """定位照片中最大的人脸
+
+    image 可以是缩小的预览图，full_size 为原图尺寸，返回的坐标都换算到原图像素：
+    {"face": (x1, y1, x2, y2), "eyes_y": 眼睛, "crown_y": 头顶, "chin_y": 下巴}。
+    没有检测到人脸时返回 None。
+    """
+    face_cascade, eye_cascade = _cascades()
+    full_size = full_size or image.size
+
+    factor = max(1.0, max(image.size) / PROXY_LONG_SIDE)
+    proxy_size = (max(1, round(image.width / factor)), max(1, round(image.height / factor)))
+    proxy = image.convert("RGB").resize(proxy_size, Image.Resampling.BOX, reducing_gap=2.0)
+    rgb = np.asarray(proxy)
+    gray = np.asarray(proxy.convert("L"))
+
+    min_face = min(proxy_size) // 6
+    faces = face_cascade.detectMultiScale(gray, 1.15, 4, minSize=(min_face, min_face))
+    if len(faces) == 0:
+        return None
+    x, y, w, h = (int(v) for v in max(faces, key=lambda f: f[2] * f[3]))
+
+    # 只在人脸框上半部分找眼睛，取最大的两个
+    upper = gray[y:y + h * 6 // 10, x:x + w]
+    eyes = eye_cascade.detectMultiScale(upper, 1.1, 4, minSize=(w // 10, w // 10))
+    eyes = sorted(eyes, key=lambda e: e[2] * e[3], reverse=True)[:2]
+    if eyes:
+        eyes_y = y + float(sum(ey + eh / 2 for _, ey, _, eh in eyes)) / len(eyes)
+    else:
+        eyes_y = y + h * EYES_FACTOR
+
+    # 代理图坐标换算到原图
+    sx = full_size[0] / proxy_size[0]
+    sy = full_size[1] / proxy_size[1]
+    return {
+        "face": (x * sx, y * sy, (x + w) * sx, (y + h) * sy),
+        "eyes_y": eyes_y * sy,
+        "crown_y": _crown(rgb, (x, y, w, h)) * sy,
+        "chin_y": (y + h * CHIN_FACTOR) * sy,
+    }
@@ -0,0 +1,133 @@
+"""多线程分块重采样，结果与一次 Image.resize 调用逐位相同
+
+Pillow 的重采样分两遍：先水平方向把原图中垂直滤镜用得到的行重采样到目标宽度，
+得到中间图，再垂直方向重采样到目标高度；两遍都会释放 GIL。这里把两遍拆开：
+
+    水平遍  把需要的原图行分成若干行带，每个行带按原来的水平 box 单独重采样。
+            行带的纵向 box 覆盖整个行带，Pillow 跳过垂直遍，各行的计算与整图
+            调用完全相同，行带之间不需要重叠。
+    垂直遍  中间图保持原图的高度（只填充用得到的行），按列分块，每块用原来的
+            纵向 box 重采样。输入高度和 box 不变，滤镜系数与整图调用完全相同。
+
+滤镜的支撑范围按 Pillow 的 precompute_coeffs 计算，只用来确定水平遍需要哪些行，
+两端再多算 SUPPORT_MARGIN_ROWS 行，Pillow 的取整方式略有变化时也不会漏算。
+像素数少于 PARALLEL_MIN_PIXELS 或模式不是 RGB/L 时直接调用 Image.resize。
+"""
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+# Pillow 各重采样滤镜的支撑半径（输出像素为单位）
+FILTER_SUPPORT = {
+    Image.Resampling.NEAREST: 0.0,
+    Image.Resampling.BOX: 0.5,
+    Image.Resampling.BILINEAR: 1.0,
+    Image.Resampling.HAMMING: 1.0,
+    Image.Resampling.BICUBIC: 2.0,
+    Image.Resampling.LANCZOS: 3.0,
+}
+
+# 读取的原图像素加输出像素少于该值时，线程调度的开销超过收益
+PARALLEL_MIN_PIXELS = 4_000_000
+
+# 每个线程至少处理的行数或列数
+MIN_TILE = 64
+
+# 水平遍在支撑范围两端多算的行数，多算的行不影响结果
+SUPPORT_MARGIN_ROWS = 2
+
+_executor = None
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1,
+                                       thread_name_prefix="resize")
+    return _executor
+
+
+def support_bounds(in_size, out_size, box0, box1, support):
+    """按 Pillow precompute_coeffs 计算第一个和最后一个输出像素读取的输入范围
+
+    返回 (first, last)，输出像素读取 [first, last) 之间的输入像素。
+    """
+    scale = (box1 - box0) / out_size
+    filterscale = max(scale, 1.0)
+    support = support * filterscale
+
+    def bounds(index):
+        center = box0 + (index + 0.5) * scale
+        low = max(int(center - support + 0.5), 0)
+        high = min(int(center + support + 0.5), in_size)
+        return low, high
+
+    return bounds(0)[0], bounds(out_size - 1)[1]
+
+
+def _split(start, stop, parts):
+    step = max(MIN_TILE, math.ceil((stop - start) / parts))
+    return [(low, min(low + step, stop)) for low in range(start, stop, step)]
+
+
+def resize(image, size, resample=Image.Resampling.LANCZOS, box=None):
+    """与 image.resize(size, resample, box) 结果相同，大图时用多个线程计算"""
+    width, height = size
+    if box is None:
+        box = (0, 0) + image.size
+    box = tuple(float(v) for v in box)
+    workers = os.cpu_count() or 1
+
+    read_pixels = (box[2] - box[0]) * (box[3] - box[1])
+    # NEAREST 在 Pillow 中不走卷积重采样，直接调用 resize
+    if (workers < 2 or image.mode not in ("RGB", "L")
+            or resample not in FILTER_SUPPORT or resample == Image.Resampling.NEAREST
+            or read_pixels + width * height < PARALLEL_MIN_PIXELS):
+        return image.resize(size, resample, box)
+
+    # 延迟解码的图片先在当前线程解码，避免多个线程同时调用 load()
+    image.load()
+    support = FILTER_SUPPORT[resample]
+    need_horizontal = width != image.width or box[0] != 0 or box[2] != image.width
+    need_vertical = height != image.height or box[1] != 0 or box[3] != image.height
+    pool = _pool()
+
+    # 水平遍：只计算垂直遍读取的行，行带之间互不依赖
+    if need_horizontal:
+        if need_vertical:
+            first, last = support_bounds(image.height, height, box[1], box[3], support)
+            first = max(first - SUPPORT_MARGIN_ROWS, 0)
+            last = min(last + SUPPORT_MARGIN_ROWS, image.height)
+        else:
+            first, last = 0, image.height
+
+        def horizontal(rows):
+            band = image.crop((0, rows[0], image.width, rows[1]))
+            return rows[0], band.resize((width, band.height), resample,
+                                        (box[0], 0, box[2], band.height))
+
+        bands = list(pool.map(horizontal, _split(first, last, workers)))
+        if not need_vertical:
+            result = Image.new(image.mode, size)
+            for top, band in bands:
+                result.paste(band, (0, top))
+            return result
+        # 中间图保持原图高度，垂直遍的滤镜系数才与整图调用相同
+        temp = Image.new(image.mode, (width, image.height))
+        for top, band in bands:
+            temp.paste(band, (0, top))
+    else:
+        temp = image
+
+    # 垂直遍：按列分块，每块保持完整高度，横向 box 覆盖整块，Pillow 跳过水平遍
+    def vertical(columns):
+        tile = temp.crop((columns[0], 0, columns[1], temp.height))
+        return columns[0], tile.resize((tile.width, height), resample,
+                                       (0, box[1], tile.width, box[3]))
+
+    result = Image.new(image.mode, size)
+    for left, tile in pool.map(vertical, _split(0, width, workers)):
+        result.paste(tile, (left, 0))
+    return result
@@ -1,46 +1,58 @@
+from spec_catalog import load_catalog
+
+
 class PhotoConfig:
-    # Photo specifications for different document types
-    SPECIFICATIONS = {
-        "P.R.China Passport": {
-            "width_mm": 33,
-            "height_mm": 48,
-            "dpi": 300,
-            "bg_color": (255, 255, 255),  # White background
-            "description": "Chinese Passport (33x48mm)",
-            "guide_lines": {
-                 "eyes_position_min": 28,  # 眼睛距离底部最小距离（mm）
-                 "eyes_position_max": 35,  # 眼睛距离底部最大距离（mm）
-                 "head_size_min": 25,      # 最小头部高度（mm）
-                 "head_size_max": 35,      # 最大头部高度（mm）
-             }
-        },
-         "US Passport": {
-             "width_mm": 51,    # 2英寸
-             "height_mm": 51,   # 2英寸
-             "dpi": 300,
-             "bg_color": (255, 255, 255),
-             "description": "US Passport (51x51mm)",
-             "guide_lines": {
-                 "eyes_position_min": 28,  # 眼睛距离底部最小距离（mm）
-                 "eyes_position_max": 35,  # 眼睛距离底部最大距离（mm）
-                 "head_size_min": 25,      # 最小头部高度（mm）
-                 "head_size_max": 35,      # 最大头部高度（mm）
-             }
-         },
-    }
+    # 打印排版可选的输出 DPI
+    PRINT_DPI_OPTIONS = [300, 600, 1200]
+
+    # 保存打印排版时的内存上限（MB），TIFF 按条带写出以满足该限制
+    SHEET_MEMORY_BUDGET_MB = 256
+    # 打印排版中相邻照片之间的裁切间距（mm）
+    PRINT_CUT_MARGIN_MM = 0
+
+    # 证件照规格和打印纸由 catalog/ 目录加载，启动时校验一次并预先计算像素几何
+    # 和排版数量；SPECIFICATIONS/PAPER_SIZES 为 {名称: 配置字典}，按文件顺序排列
+    CATALOG = load_catalog(cut_margin_mm=PRINT_CUT_MARGIN_MM)
+    SPECIFICATIONS = CATALOG.specs
+    PAPER_SIZES = CATALOG.papers
 
-    # 添加照片纸尺寸配置
-    PAPER_SIZES = {
-        "4x6 inch": {
-            "width_mm": 152.4,  # 6 inch
-            "height_mm": 101.6, # 4 inch
-            "dpi": 300,
-            "description": "4x6 inch photo paper"
+    # 渲染结果磁盘缓存的大小上限（MB），超出时淘汰最久未使用的结果
+    RESULT_CACHE_MB = 2048
+    # 原图完整解码后的内存上限（MB），超出时缩小到规格实际需要的分辨率；0 表示不限制
+    SOURCE_MEMORY_BUDGET_MB = 256
+    # 缩小后原图短边至少为最大规格长边像素数的倍数，保证放大裁剪时仍有足够细节
+    SOURCE_DETAIL_FACTOR = 4
+
+    # 导出配置：格式、色度抽样、渐进式/优化、DPI 元数据和文件大小限制
+    # （min_bytes/max_bytes）；有大小限制时按编码质量二分查找
+    EXPORT_PROFILES = {
+        "Standard JPEG": {
+            "format": "JPEG",
+            "quality": 95,
+            "description": "JPEG quality 95",
+        },
+        "High Quality JPEG": {
+            "format": "JPEG",
+            "quality": 95,
+            "subsampling": "4:4:4",
+            "optimize": True,
+            "description": "JPEG quality 95 without chroma subsampling",
+        },
+        "Online Visa (54-240 KB)": {
+            "format": "JPEG",
+            "quality": 95,
+            "subsampling": "4:2:0",
+            "optimize": True,
+            "progressive": False,
+            # 上传页面的 KB 可能按 1000 或 1024 计算，两种都满足
+            "min_bytes": 54 * 1024,
+            "max_bytes": 240 * 1000,
+            "description": "Baseline JPEG between 54 KB and 240 KB",
         },
-        "5x7 inch": {
-            "width_mm": 177.8,  # 7 inch
-            "height_mm": 127.0, # 5 inch
-            "dpi": 300,
-            "description": "5x7 inch photo paper"
-        }
-    }
\ No newline at end of file
+        "PNG": {
+            "format": "PNG",
+            "optimize": False,
+            "description": "Lossless PNG",
+        },
+    }
+    DEFAULT_EXPORT_PROFILE = "Standard JPEG"
@@ -0,0 +1,522 @@
+"""证件照处理核心
+
+几何换算、亮度/对比度、裁剪、打印排版与保存，只接受普通参数，不依赖 Tk。
+编辑器界面、批处理、合规检查和基准测试都使用这里的函数；导入本模块不会
+加载 tkinter，适合在工作进程和没有显示器的服务器上使用。
+"""
+import math
+import threading
+
+from PIL import Image, ImageDraw
+
+from background import composite_background, feather_mask
+from export_profiles import encode_image, sheet_profile
+from parallel_resize import FILTER_SUPPORT, resize as parallel_resize
+from photo_configs import PhotoConfig
+from sheet_packing import SheetPacker
+from spec_catalog import spec_pixel_size
+from tiff_writer import write_tiff
+
+# 编辑画布尺寸，画布坐标同时也是批处理清单中 offset 的坐标系
+CANVAS_SIZE = (800, 1000)
+
+
+def image_buffer_bytes(*images):
+    """Pillow 图像缓冲区占用的字节数，同一图像只计一次，RGB 图像每像素占 4 字节"""
+    unique = {id(image): image for image in images if image is not None}
+    return sum(
+        image.width * image.height * (1 if image.mode in ("1", "L", "P") else 4)
+        for image in unique.values()
+    )
+
+
+def required_source_size(size, detail_factor=PhotoConfig.SOURCE_DETAIL_FACTOR):
+    """原图缩小后仍能满足所有规格的最小尺寸，原图本身不够大时返回原尺寸
+
+    裁剪框以规格 DPI 的像素数输出，原图短边保留最大规格长边的 detail_factor
+    倍，放大到只裁剪原图 1/detail_factor 的区域时也不需要插值放大。
+    """
+    ratio = PhotoConfig.CATALOG.max_pixel_side * detail_factor / min(size)
+    if ratio >= 1:
+        return tuple(size)
+    return max(1, round(size[0] * ratio)), max(1, round(size[1] * ratio))
+
+
+def crop_box_position(canvas_size, target_size):
+    """裁剪框在画布上的左上角坐标"""
+    return (canvas_size[0] - target_size[0]) // 2, (canvas_size[1] - target_size[1]) // 2
+
+
+def auto_fit(landmarks, spec, source_size, canvas_size=CANVAS_SIZE):
+    """根据 locate_face 的结果计算 (scale, (offset_x, offset_y))
+
+    头部高度（头顶到下巴）缩放到 guide_lines 头部范围的中间值，眼睛落在眼睛
+    范围的中间，脸部水平居中于裁剪框。
+    """
+    guide = spec["guide_lines"]
+    mm_to_px = spec["dpi"] / 25.4
+    target_width, target_height = spec_pixel_size(spec)
+    crop_x, crop_y = crop_box_position(canvas_size, (target_width, target_height))
+
+    head_px = landmarks["chin_y"] - landmarks["crown_y"]
+    head_target = (guide["head_size_min"] + guide["head_size_max"]) / 2 * mm_to_px
+    scale = head_target / head_px
+
+    # 画布坐标 = 图片左上角 + 原图坐标 * 显示比例，与 visible_region 一致
+    width, height = source_size
+    display_w, display_h = int(width * scale), int(height * scale)
+    eyes_target = (guide["eyes_position_min"] + guide["eyes_position_max"]) / 2 * mm_to_px
+    target_x = crop_x + target_width / 2
+    target_y = crop_y + target_height - eyes_target
+    face_x = (landmarks["face"][0] + landmarks["face"][2]) / 2
+    offset_x = target_x - face_x * display_w / width + display_w / 2
+    offset_y = target_y - landmarks["eyes_y"] * display_h / height + display_h / 2
+    return scale, (offset_x, offset_y)
+
+
+def visible_region(source_size, scale, offset, viewport_size):
+    """计算图片在视口中的可见部分
+
+    图片以 offset 为中心、按 scale 缩放显示。返回 (画布矩形, 原图矩形)，
+    画布矩形为整像素坐标，原图矩形为浮点坐标；图片完全不可见时返回 None。
+    """
+    w, h = source_size
+    display_w, display_h = int(w * scale), int(h * scale)
+    if display_w <= 0 or display_h <= 0:
+        return None
+
+    # 缩放后图片左上角在画布上的位置
+    left = offset[0] - display_w / 2
+    top = offset[1] - display_h / 2
+
+    # 与视口相交的画布区域
+    x1 = max(0, math.floor(left))
+    y1 = max(0, math.floor(top))
+    x2 = min(viewport_size[0], math.ceil(left + display_w))
+    y2 = min(viewport_size[1], math.ceil(top + display_h))
+    if x2 <= x1 or y2 <= y1:
+        return None
+
+    # 映射回原图坐标
+    fx = w / display_w
+    fy = h / display_h
+    box = (
+        max(0.0, (x1 - left) * fx),
+        max(0.0, (y1 - top) * fy),
+        min(float(w), (x2 - left) * fx),
+        min(float(h), (y2 - top) * fy),
+    )
+    if box[2] <= box[0] or box[3] <= box[1]:
+        return None
+    return (x1, y1, x2, y2), box
+
+
+def scale_box(box, full_size, size):
+    """把原图坐标中的矩形换算到同一张图缩小后（尺寸为 size）的坐标"""
+    if size == tuple(full_size):
+        return box
+    fx = size[0] / full_size[0]
+    fy = size[1] / full_size[1]
+    return (
+        box[0] * fx,
+        box[1] * fy,
+        min(float(size[0]), box[2] * fx),
+        min(float(size[1]), box[3] * fy),
+    )
+
+
+def render_viewport(image, scale, offset, viewport_size, resample=Image.Resampling.LANCZOS,
+                    full_size=None):
+    """只重采样视口内可见的区域，返回 (缓冲图, 画布左上角)
+
+    full_size 为原图尺寸；image 可以是金字塔中缩小后的一级，此时 scale
+    仍然相对于原图，原图坐标会按比例换算到该级上。
+    """
+    if full_size is None:
+        full_size = image.size
+    region = visible_region(full_size, scale, offset, viewport_size)
+    if region is None:
+        return None, None
+    (x1, y1, x2, y2), box = region
+
+    box = scale_box(box, full_size, image.size)
+    buffer = image.resize((x2 - x1, y2 - y1), resample, box=box)
+    return buffer, (x1, y1)
+
+
+def adjustment_lut(brightness, contrast, histogram):
+    """把亮度和对比度调整合并为一张 0-255 的查找表
+
+    ImageEnhance.Brightness 和 ImageEnhance.Contrast 都是逐像素的 Image.blend，
+    在 256 级灰阶上做同样的两次 blend 即可得到结果一致的查找表。对比度所需的
+    灰度均值由原图各通道的直方图推算，不需要再遍历整张图片。
+    """
+    ramp = Image.frombytes("L", (256, 1), bytes(range(256)))
+    brightened = Image.blend(Image.new("L", (256, 1), 0), ramp, brightness)
+    brightness_lut = brightened.tobytes()
+
+    # 亮度调整后各通道的均值
+    count = sum(histogram[:256])
+    means = []
+    for band in range(len(histogram) // 256):
+        band_histogram = histogram[band * 256:(band + 1) * 256]
+        means.append(sum(n * v for n, v in zip(band_histogram, brightness_lut)) / count)
+
+    # 与 convert("L") 相同的灰度权重
+    if len(means) >= 3:
+        grey = (means[0] * 299 + means[1] * 587 + means[2] * 114) / 1000
+    else:
+        grey = means[0]
+    mean = int(grey + 0.5)
+
+    adjusted = Image.blend(Image.new("L", (256, 1), mean), brightened, contrast)
+    return list(adjusted.tobytes())
+
+
+def apply_lut(image, lut):
+    """用一次 Image.point 对每个通道应用同一张查找表"""
+    return image.point(lut * len(image.getbands()))
+
+
+# 按条带缩小大图时每个条带的行数
+SHRINK_STRIP_ROWS = 256
+
+
+def _to_rgb(image):
+    """转换为 RGB，透明背景填充为白色"""
+    # Handle transparent background，只有带透明通道的图片才需要白色背景
+    if image.mode == "P" and "transparency" in image.info:
+        image = image.convert("RGBA")
+    if image.mode in ("RGBA", "LA"):
+        white_bg = Image.new("RGB", image.size, (255, 255, 255))
+        white_bg.paste(image, (0, 0), image)
+        return white_bg
+    if image.mode != "RGB":
+        return image.convert("RGB")
+    image.load()
+    return image
+
+
+def shrink_image(image, size, reducing_gap=3.0):
+    """缩小到 size 并转换为 RGB，结果与 _to_rgb(image).resize(size, LANCZOS,
+    reducing_gap=reducing_gap) 相同
+
+    按条带转换颜色、整数倍缩小并做水平方向的重采样，最后对水平缩小后的
+    中间图做垂直方向的重采样。除已经解码的原图外只分配条带、中间图和结果，
+    不分配完整尺寸的白色背景、RGB 副本或透明图像重采样时的预乘副本。
+    """
+    factor_x = int(image.width / size[0] / reducing_gap) or 1
+    factor_y = int(image.height / size[1] / reducing_gap) or 1
+    reduced_width = image.width / factor_x
+
+    # 条带高度取 factor_y 的整数倍，条带的缩小结果与整图 reduce 相同；
+    # 中间图保持缩小后的完整高度，垂直方向的滤镜系数与整图调用相同
+    strip = factor_y * max(1, SHRINK_STRIP_ROWS // factor_y)
+    temp = Image.new("RGB", (size[0], -(-image.height // factor_y)))
+    for top in range(0, image.height, strip):
+        band = _to_rgb(image.crop((0, top, image.width, min(top + strip, image.height))))
+        if factor_x > 1 or factor_y > 1:
+            band = band.reduce((factor_x, factor_y))
+        band = band.resize((size[0], band.height), Image.Resampling.LANCZOS,
+                           (0, 0, reduced_width, band.height))
+        temp.paste(band, (0, top // factor_y))
+    return parallel_resize(temp, size, Image.Resampling.LANCZOS,
+                           (0, 0, size[0], image.height / factor_y))
+
+
+def load_source_image(file_path, draft_size=None, max_size=None):
+    """打开图片并转换为 RGB，透明背景填充为白色
+
+    draft_size 不为 None 时，JPEG 会在 DCT 域直接缩小解码到不小于该尺寸，
+    用于快速显示预览；其它格式忽略该参数。max_size 不为 None 时，解码后
+    仍大于该尺寸的图像用 shrink_image 缩小到 max_size。
+    """
+    original = Image.open(file_path)
+    if draft_size:
+        original.draft("RGB", draft_size)
+    if max_size and original.width > max_size[0]:
+        original.load()
+        return shrink_image(original, max_size)
+    return _to_rgb(original)
+
+
+class SourceImage:
+    """原图：打开时只解码预览尺寸，完整分辨率在需要时才解码
+
+    完整解码超出 memory_budget_mb 时，原图缩小到 required_source_size，
+    full_image 可能小于 size；坐标和缩放比例始终以 size 为准。
+    """
+
+    # 快速打开时预览图长边的最小像素数
+    PREVIEW_LONG_SIDE = 1600
+
+    def __init__(self, file_path, memory_budget_mb=PhotoConfig.SOURCE_MEMORY_BUDGET_MB):
+        self.file_path = file_path
+        self.memory_budget_mb = memory_budget_mb
+        
+        # 只读取文件头得到原图尺寸
+        with Image.open(file_path) as header:
+            self.size = header.size
+        
+        draft_size = None
+        long_side = max(self.size)
+        if long_side > self.PREVIEW_LONG_SIDE:
+            ratio = self.PREVIEW_LONG_SIDE / long_side
+            draft_size = (max(1, int(self.size[0] * ratio)), max(1, int(self.size[1] * ratio)))
+        budget_size = self.budget_size()
+        self.preview = load_source_image(file_path, draft_size, budget_size)
+        
+        # 不支持 draft 的格式已经是完整分辨率（超出预算时已经缩小）
+        self.full_image = None
+        if self.preview.size in (self.size, budget_size):
+            self.full_image = self.preview
+        
+        # 后台线程和主线程都可能触发完整解码
+        self._lock = threading.Lock()
+
+    @property
+    def is_full_resolution(self):
+        return self.full_image is not None
+
+    @property
+    def is_reduced(self):
+        """完整解码的图像是否因内存预算被缩小"""
+        return self.full_image is not None and self.full_image.size != self.size
+
+    def exceeds_budget(self):
+        budget = self.memory_budget_mb * 1024 * 1024
+        return bool(budget) and self.size[0] * self.size[1] * 4 > budget
+
+    def budget_size(self):
+        """完整解码超出预算时缩小到的尺寸，不超出时返回 None"""
+        return required_source_size(self.size) if self.exceeds_budget() else None
+
+    def load_full(self):
+        """完整解码原图，之后预览图直接使用原图"""
+        with self._lock:
+            if self.full_image is None:
+                # 超出预算时 JPEG 直接在 DCT 域缩小解码，其它格式解码后先缩小
+                # 再转换颜色，不分配完整尺寸的缓冲
+                budget_size = self.budget_size()
+                self.full_image = load_source_image(self.file_path, budget_size, budget_size)
+                self.preview = self.full_image
+        return self.full_image
+
+
+def render_crop(image, scale, offset, canvas_size, target_size, bg_color, lut=None,
+                resample=Image.Resampling.LANCZOS, mask=None, full_size=None):
+    """把画布上裁剪框内的内容直接重采样为最终尺寸的照片
+
+    裁剪框映射回原图坐标后只做一次重采样，超出原图的部分用 bg_color 填充，
+    不需要先把整张原图缩放到 scale。lut 为亮度/对比度查找表，只作用于参与
+    重采样的原图区域。mask 为 background_mask 得到的背景掩码，给出时背景
+    替换为 bg_color。full_size 为原图尺寸，image 因内存预算被缩小时 scale
+    仍然相对于原图。
+    """
+    final_image = Image.new("RGB", target_size, bg_color)
+    if full_size is None:
+        full_size = image.size
+
+    # 以裁剪框左上角为原点计算原图的可见部分
+    crop_x, crop_y = crop_box_position(canvas_size, target_size)
+    region = visible_region(
+        full_size, scale, (offset[0] - crop_x, offset[1] - crop_y), target_size
+    )
+    if region is None:
+        return final_image
+    (x1, y1, x2, y2), box = region
+    box = scale_box(box, full_size, image.size)
+
+    mask_part = None
+    if mask is not None:
+        # 掩码按相同的原图矩形放大到输出尺寸并羽化
+        fx = mask.width / image.width
+        fy = mask.height / image.height
+        mask_box = (box[0] * fx, box[1] * fy, box[2] * fx, box[3] * fy)
+        mask_part = mask.resize((x2 - x1, y2 - y1), Image.Resampling.BILINEAR, box=mask_box)
+        mask_part = feather_mask(mask_part, (x2 - x1) / (mask_box[2] - mask_box[0]))
+
+    if lut:
+        # 查找表需要覆盖滤镜读取到的所有像素
+        support = FILTER_SUPPORT[resample]
+        margin_x = math.ceil(support * max(1.0, (box[2] - box[0]) / (x2 - x1))) + 1
+        margin_y = math.ceil(support * max(1.0, (box[3] - box[1]) / (y2 - y1))) + 1
+        left = max(0, math.floor(box[0]) - margin_x)
+        top = max(0, math.floor(box[1]) - margin_y)
+        right = min(image.width, math.ceil(box[2]) + margin_x)
+        bottom = min(image.height, math.ceil(box[3]) + margin_y)
+        image = apply_lut(image.crop((left, top, right, bottom)), lut)
+        box = (box[0] - left, box[1] - top, box[2] - left, box[3] - top)
+
+    # 导出时原图区域可能很大，分块在多个线程中重采样，结果与单次 resize 相同
+    part = parallel_resize(image, (x2 - x1, y2 - y1), resample, box)
+    if mask_part is not None:
+        part = composite_background(part, mask_part, bg_color)
+    final_image.paste(part, (x1, y1))
+    return final_image
+
+
+def crop_photo(image, spec, scale, offset, brightness=1.0, contrast=1.0, histogram=None,
+               mask=None, canvas_size=CANVAS_SIZE, full_size=None):
+    """按编辑参数导出成品照片
+
+    scale 和 offset 为编辑画布上的缩放与图片中心，histogram 默认使用 image 的
+    直方图，mask 为背景掩码，给出时背景替换为规格的 bg_color；full_size 为
+    原图尺寸，默认为 image 的尺寸。
+    """
+    lut = None
+    if brightness != 1.0 or contrast != 1.0:
+        lut = adjustment_lut(brightness, contrast, histogram or image.histogram())
+    return render_crop(image, scale, offset, canvas_size, spec_pixel_size(spec),
+                       spec["bg_color"], lut, mask=mask, full_size=full_size)
+
+
+class ImagePyramid:
+    """多分辨率图像金字塔，每一级宽高缩小为上一级的一半"""
+
+    # 最小一级的短边不小于该值
+    MIN_LEVEL_SIZE = 256
+
+    def __init__(self, image, full_size=None):
+        # full_size 为原图尺寸，image 可能是缩小解码得到的预览图
+        self.full_size = full_size or image.size
+        self.levels = [image]
+        while min(self.levels[-1].size) >= 2 * self.MIN_LEVEL_SIZE:
+            self.levels.append(self.levels[-1].reduce(2))
+
+    def level_index(self, scale):
+        """返回显示尺寸不小于 scale 所需尺寸的最小一级的序号"""
+        needed_width = self.full_size[0] * scale
+        for index in range(len(self.levels) - 1, 0, -1):
+            if self.levels[index].width >= needed_width:
+                return index
+        return 0
+
+
+class PrintLayout:
+    """同一规格的照片排满一张打印纸，排列由 SheetPacker 计算（可旋转）"""
+
+    def __init__(self, paper_size, photo_size, cut_margin_mm=PhotoConfig.PRINT_CUT_MARGIN_MM):
+        self.paper_size = paper_size
+        self.photo_spec = photo_size
+        self.packer = SheetPacker(paper_size, cut_margin_mm)
+        self.max_photos = PhotoConfig.CATALOG.sheet_capacity(paper_size, photo_size, cut_margin_mm)
+
+    def get_placements(self, photo, num_photos):
+        """返回 compose_sheet 使用的位置列表，数量不超过一张纸的容量"""
+        num_photos = min(num_photos, self.max_photos)
+        if num_photos <= 0:
+            return []
+        return self.packer.pack([(photo, self.photo_spec, num_photos)])[0]
+
+
+def resize_once(cache, photo, size):
+    """同一张照片缩放到同一尺寸只重采样一次，结果保存在 cache 中复用"""
+    key = (id(photo), size)
+    if key not in cache:
+        cache[key] = parallel_resize(photo, size, Image.Resampling.LANCZOS)
+    return cache[key]
+
+
+def sheet_pixel_size(paper_size, dpi=None):
+    """打印纸在给定 DPI 下的像素尺寸 (宽, 高)，dpi 默认使用纸张配置"""
+    dpi = dpi or paper_size["dpi"]
+    return (int(paper_size["width_mm"] * dpi / 25.4),
+            int(paper_size["height_mm"] * dpi / 25.4))
+
+
+def iter_sheet_strips(paper_size, placements, strip_height, dpi=None):
+    """按水平条带逐条生成打印纸图像
+
+    placements 为 (照片, (x_mm, y_mm), (宽_mm, 高_mm)) 列表。每张不同的照片只
+    重采样一次，所有位置共用同一个缓冲图；内存中始终只有一个条带。
+    """
+    dpi = dpi or paper_size["dpi"]
+    paper_width_px, paper_height_px = sheet_pixel_size(paper_size, dpi)
+    
+    # 转换位置和尺寸为像素
+    resized_photos = {}
+    boxes = []
+    for photo, (x_mm, y_mm), (width_mm, height_mm) in placements:
+        photo_width_px = int(width_mm * dpi / 25.4)
+        photo_height_px = int(height_mm * dpi / 25.4)
+        photo_resized = resize_once(resized_photos, photo, (photo_width_px, photo_height_px))
+        boxes.append((photo_resized, int(x_mm * dpi / 25.4), int(y_mm * dpi / 25.4)))
+    
+    for top in range(0, paper_height_px, strip_height):
+        bottom = min(paper_height_px, top + strip_height)
+        
+        # 创建白色背景的条带
+        strip = Image.new('RGB', (paper_width_px, bottom - top), 'white')
+        draw = ImageDraw.Draw(strip)
+        
+        # 在与条带相交的位置粘贴照片并画边框
+        for photo_resized, x_px, y_px in boxes:
+            if y_px >= bottom or y_px + photo_resized.height <= top:
+                continue
+            strip.paste(photo_resized, (x_px, y_px - top))
+            
+            # 画黑色边框
+            draw.rectangle(
+                [x_px, y_px - top, 
+                 x_px + photo_resized.width - 1,  # -1 避免边框重叠
+                 y_px - top + photo_resized.height - 1],
+                outline='black',
+                width=1
+            )
+        yield strip
+
+
+def compose_sheet(paper_size, placements, dpi=None):
+    """把照片贴到实际 DPI 的整张打印纸上，返回整张图像"""
+    paper_height_px = sheet_pixel_size(paper_size, dpi)[1]
+    return next(iter_sheet_strips(paper_size, placements, paper_height_px, dpi))
+
+
+def save_sheet(save_path, paper_size, placements, dpi=None,
+               memory_budget_mb=PhotoConfig.SHEET_MEMORY_BUDGET_MB, profile=None):
+    """保存打印排版，内存占用不超过 memory_budget_mb
+
+    .tif/.tiff 按条带逐条合成并压缩写入，任何纸张和 DPI 都只占用固定内存；
+    其它扩展名按导出配置 profile 的格式和色度抽样编码（质量 95，不受配置的
+    文件大小限制），需要整张图像在内存中，超出预算时报错。
+    """
+    dpi = dpi or paper_size["dpi"]
+    paper_width_px, paper_height_px = sheet_pixel_size(paper_size, dpi)
+    budget = memory_budget_mb * 1024 * 1024
+    
+    # 每张照片缩放后的缓冲图常驻内存，Pillow 的 RGB 图像每像素占 4 字节
+    photo_bytes = 0
+    for size in {(int(w * dpi / 25.4), int(h * dpi / 25.4)) for _, _, (w, h) in placements}:
+        photo_bytes += size[0] * size[1] * 4
+    
+    if save_path.lower().endswith((".tif", ".tiff")):
+        # 条带本身（每像素 4 字节）加上 tobytes() 的副本和压缩结果
+        row_bytes = paper_width_px * 8
+        strip_height = max(16, (budget - photo_bytes) // row_bytes)
+        strip_height = min(strip_height, paper_height_px)
+        write_tiff(
+            save_path,
+            (paper_width_px, paper_height_px),
+            iter_sheet_strips(paper_size, placements, strip_height, dpi),
+            strip_height,
+            dpi
+        )
+        return
+    
+    if photo_bytes + paper_width_px * paper_height_px * 4 > budget:
+        raise ValueError(
+            f"{paper_width_px}x{paper_height_px} sheet exceeds the "
+            f"{memory_budget_mb} MB memory budget, save as TIFF instead"
+        )
+    print_image = compose_sheet(paper_size, placements, dpi)
+    data = encode_image(print_image, sheet_profile(profile), dpi)
+    with open(save_path, "wb") as f:
+        f.write(data)
+
+
+def print_placements(photo, paper_size, photo_spec, num_photos, layout=None):
+    """按打印纸尺寸排版同一张照片，返回 compose_sheet 使用的位置列表"""
+    if layout is None:
+        layout = PrintLayout(paper_size, photo_spec)
+    return layout.get_placements(photo, num_photos)
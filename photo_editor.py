@@ -1,84 +1,127 @@
+import traceback
 import tkinter as tk
 from tkinter import filedialog, ttk
-from PIL import Image, ImageTk, ImageEnhance
+from PIL import Image, ImageTk
 from photo_configs import PhotoConfig
-import math
-from PIL import ImageDraw
 from tkinter import messagebox
+from concurrent.futures import ThreadPoolExecutor
+from face_locator import locate_face
+from background import background_mask, composite_background, feather_mask
+from edit_history import EditHistory, RenderCache
+from export_profiles import encode_image, export_profile, profile_extension
+import telemetry
+from photo_core import (
+    CANVAS_SIZE,
+    ImagePyramid,
+    PrintLayout,
+    SourceImage,
+    adjustment_lut,
+    apply_lut,
+    auto_fit,
+    crop_box_position,
+    crop_photo,
+    image_buffer_bytes,
+    print_placements,
+    render_viewport,
+    save_sheet,
+    sheet_pixel_size,
+)
+from sheet_packing import print_size_mm
 
-class PrintLayout:
-    def __init__(self, paper_size, photo_size):
-        # 特殊处理美国护照照片在4x6照相纸上的布局
-        is_us_passport = (photo_size["width_mm"] == 51 and photo_size["height_mm"] == 51)  # 2x2 inch
-        is_4x6_paper = (paper_size["width_mm"] == 152.4 and paper_size["height_mm"] == 101.6)  # 4x6 inch
-        
-        if is_us_passport and is_4x6_paper:
-            # 使用实际英寸计算（忽略毫米的精确转换）
-            self.rows = 2  # 4 inch 高度可以放 2 张 2x2 的照片
-            self.cols = 3  # 6 inch 宽度可以放 3 张 2x2 的照片
-            self.max_photos = self.rows * self.cols  # 最多 6 张
-            
-            # 计算每张照片的实际尺寸（稍微减小以确保打印效果）
-            self.photo_width = 50.8  # 约 1.97 inch
-            self.photo_height = 50.8
-            
-            # 计算边距使照片均匀分布
-            self.actual_margin_x = (paper_size["width_mm"] - (self.cols * self.photo_width)) / 2
-            self.actual_margin_y = (paper_size["height_mm"] - (self.rows * self.photo_height)) / 2
-        else:
-            # 其他照片类型使用原始的精确计算
-            self.paper_width = paper_size["width_mm"]
-            self.paper_height = paper_size["height_mm"]
-            self.photo_width = photo_size["width_mm"]
-            self.photo_height = photo_size["height_mm"]
-            
-            # 设置2mm边距
-            self.margin_mm = 0
-            self.spacing_mm = 0
-            
-            # 计算可用空间
-            self.usable_width = self.paper_width - 2 * self.margin_mm
-            self.usable_height = self.paper_height - 2 * self.margin_mm
-            
-            # 计算常规布局
-            self.calculate_layout()
-    
-    def calculate_layout(self):
-        """计算最大可打印数量和最优布局"""
-        # 计算每个方向可以放置的最大数量（无间距）
-        cols = int(self.usable_width / self.photo_width)
-        rows = int(self.usable_height / self.photo_height)
-        
-        self.max_photos = rows * cols
-        self.rows = rows
-        self.cols = cols
-        
-        # 计算实际边距以使布局居中
-        self.actual_margin_x = (self.paper_width - (cols * self.photo_width)) / 2
-        self.actual_margin_y = (self.paper_height - (rows * self.photo_height)) / 2
-    
-    def get_photo_positions(self, num_photos):
-        """获取照片位置"""
-        positions = []
-        for i in range(min(num_photos, self.max_photos)):
-            row = i // self.cols
-            col = i % self.cols
-            
-            if hasattr(self, 'actual_margin_x'):
-                # 美国护照照片的特殊布局
-                x = self.actual_margin_x + col * self.photo_width
-                y = self.actual_margin_y + row * self.photo_height
+
+class BackgroundTasks:
+    """在后台线程中执行耗时任务，结果通过 root.after 轮询交回 Tk 主线程
+
+    每个任务有一个名字，提交同名任务或调用 cancel 时，尚未完成的旧任务会被
+    取消，已经开始执行的旧任务结果直接丢弃。任务运行期间 status_label 显示
+    忙碌提示。
+    """
+
+    POLL_INTERVAL_MS = 50
+    SPINNER = "|/-\\"
+
+    def __init__(self, root, status_label, max_workers=2):
+        self.root = root
+        self.status_label = status_label
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.running = {}  # name -> (future, message, on_done, on_error)
+        self.poll_job = None
+        self.spinner_index = 0
+        self.busy_text = None
+        self.idle_status = None
+
+    def submit(self, name, message, func, *args, on_done=None, on_error=None):
+        """提交任务，完成后在主线程调用 on_done(result) 或 on_error(exception)"""
+        self.cancel(name)
+        if not self.running:
+            # 记录忙碌提示之前的状态，任务被取消时恢复
+            self.idle_status = (self.status_label.cget("text"), self.status_label.cget("fg"))
+        future = self.executor.submit(telemetry.traced(name, func), *args)
+        self.running[name] = (future, message, on_done, on_error)
+        if self.poll_job is None:
+            self.poll_job = self.root.after(self.POLL_INTERVAL_MS, self.poll)
+        self.show_busy()
+
+    def cancel(self, *names):
+        """取消任务，正在执行的任务结果会被丢弃"""
+        for name in names:
+            task = self.running.pop(name, None)
+            if task:
+                task[0].cancel()
+
+    def is_running(self, name):
+        return name in self.running
+
+    def poll(self):
+        self.poll_job = None
+        try:
+            for name, task in list(self.running.items()):
+                future, message, on_done, on_error = task
+                if not future.done():
+                    continue
+                del self.running[name]
+                try:
+                    self.deliver(future, message, on_done, on_error)
+                except Exception as e:
+                    # 一个回调出错不能影响其它任务的结果交付和后续轮询
+                    traceback.print_exc()
+                    self.status_label.config(text=f"{message} failed: {e}", fg="red")
+        finally:
+            if self.running:
+                self.spinner_index = (self.spinner_index + 1) % len(self.SPINNER)
+                self.show_busy()
+                self.poll_job = self.root.after(self.POLL_INTERVAL_MS, self.poll)
+            elif self.status_label.cget("text") == self.busy_text and self.idle_status:
+                # 回调没有更新状态（例如任务被取消），恢复之前的提示
+                self.status_label.config(text=self.idle_status[0], fg=self.idle_status[1])
+
+    def deliver(self, future, message, on_done, on_error):
+        """在主线程调用已完成任务的回调"""
+        try:
+            result = future.result()
+        except Exception as e:
+            if on_error:
+                on_error(e)
             else:
-                # 常规布局
-                x = self.margin_mm + col * self.photo_width
-                y = self.margin_mm + row * self.photo_height
-            
-            positions.append((x, y))
-        
-        return positions
+                self.status_label.config(text=f"{message} failed: {e}", fg="red")
+        else:
+            if on_done:
+                on_done(result)
+
+    def show_busy(self):
+        if not self.running:
+            return
+        message = list(self.running.values())[-1][1]
+        self.busy_text = f"{message}... {self.SPINNER[self.spinner_index]}"
+        self.status_label.config(text=self.busy_text, fg="blue")
+
 
 class PrintPreviewWindow:
-    def __init__(self, parent, cropped_photo, paper_size, num_photos, id_photo_spec):
+    # 预览画布的最大尺寸，大尺寸纸张按比例缩小显示
+    MAX_PREVIEW_SIZE = (1050, 750)
+
+    def __init__(self, parent, cropped_photo, paper_size, num_photos, id_photo_spec, tasks,
+                 profile=None):
         self.preview_window = tk.Toplevel(parent)
         self.preview_window.title("Print Preview")
         
@@ -87,11 +130,16 @@ class PrintPreviewWindow:
         self.paper_size = paper_size
         self.num_photos = num_photos
         self.id_photo_spec = id_photo_spec
+        self.tasks = tasks
+        self.export_profile = profile
         
         # 计算预览画布大小（等比例缩小）
-        scale = 0.5  # 预览窗口缩放比例
-        self.canvas_width = int(paper_size["width_mm"] * paper_size["dpi"] / 25.4 * scale)
-        self.canvas_height = int(paper_size["height_mm"] * paper_size["dpi"] / 25.4 * scale)
+        paper_width_px, paper_height_px = sheet_pixel_size(paper_size)
+        scale = min(0.5,  # 预览窗口缩放比例
+                    self.MAX_PREVIEW_SIZE[0] / paper_width_px,
+                    self.MAX_PREVIEW_SIZE[1] / paper_height_px)
+        self.canvas_width = int(paper_width_px * scale)
+        self.canvas_height = int(paper_height_px * scale)
         
         # 创建预览画布
         self.canvas = tk.Canvas(self.preview_window, 
@@ -104,11 +152,23 @@ class PrintPreviewWindow:
         button_frame = tk.Frame(self.preview_window)
         button_frame.pack(fill='x', padx=10, pady=5)
         
-        tk.Button(button_frame, text="Save", 
-                 command=self.save_print_layout).pack(side='left', padx=5)
+        self.save_button = tk.Button(button_frame, text="Save", 
+                                     command=self.save_print_layout)
+        self.save_button.pack(side='left', padx=5)
         tk.Button(button_frame, text="Cancel",
                  command=self.preview_window.destroy).pack(side='left', padx=5)
         
+        # 输出 DPI 选择
+        tk.Label(button_frame, text="DPI:").pack(side='left', padx=(15, 0))
+        self.dpi_var = tk.StringVar()
+        dpi_combo = ttk.Combobox(button_frame,
+                                 textvariable=self.dpi_var,
+                                 values=[str(dpi) for dpi in PhotoConfig.PRINT_DPI_OPTIONS],
+                                 state='readonly',
+                                 width=6)
+        dpi_combo.set(str(paper_size["dpi"]))
+        dpi_combo.pack(side='left', padx=5)
+        
         # 创建布局计算器
         self.layout = PrintLayout(paper_size, id_photo_spec)
         
@@ -122,104 +182,92 @@ class PrintPreviewWindow:
         # 计算预览缩放比例
         scale = self.canvas_width / self.paper_size["width_mm"]
         
-        # 获取照片位置
-        positions = self.layout.get_photo_positions(self.num_photos)
-        
-        # 计算预览中照片的尺寸
-        preview_photo_width = round(self.id_photo_spec["width_mm"] * scale)
-        preview_photo_height = round(self.id_photo_spec["height_mm"] * scale)
+        # 照片先缩放到预览尺寸再排版，旋转的位置使用旋转后的缩略图；
+        # 每张缩略图只转换一次 PhotoImage，重绘时替换上一次的预览图
+        print_width_mm, print_height_mm = print_size_mm(self.id_photo_spec)
+        preview_size = (round(print_width_mm * scale), round(print_height_mm * scale))
+        with telemetry.span("print_preview"):
+            resized_photo = self.original_photo.resize(preview_size, Image.Resampling.LANCZOS)
+            placements = self.layout.get_placements(resized_photo, self.num_photos)
+        self.preview_images = {}
         
         # 在画布上显示所有位置
-        for i, (x, y) in enumerate(positions):
+        for photo, (x, y), _ in placements:
+            if id(photo) not in self.preview_images:
+                with telemetry.span("photoimage"):
+                    self.preview_images[id(photo)] = ImageTk.PhotoImage(photo)
             preview_x = round(x * scale)
             preview_y = round(y * scale)
             
-            # 如果这个位置需要显示照片
-            if i < self.num_photos:
-                # 先用PIL Image调整大小
-                preview_size = (preview_photo_width, preview_photo_height)
-                resized_photo = self.original_photo.resize(preview_size, Image.Resampling.LANCZOS)
-                
-                # 然后转换为PhotoImage
-                if not hasattr(self, 'preview_images'):
-                    self.preview_images = []
-                self.preview_images.append(ImageTk.PhotoImage(resized_photo))
-                
-                # 显示照片
-                self.canvas.create_image(
-                    preview_x, preview_y,
-                    image=self.preview_images[-1],
-                    anchor='nw'
-                )
-                
-                # 在照片上绘制黑色细实线边框
-                self.canvas.create_rectangle(
-                    preview_x, preview_y,
-                    preview_x + preview_photo_width,
-                    preview_y + preview_photo_height,
-                    outline='black',
-                    width=1  # 设置线条宽度为1像素
-                )
+            # 显示照片
+            self.canvas.create_image(
+                preview_x, preview_y,
+                image=self.preview_images[id(photo)],
+                anchor='nw'
+            )
+            
+            # 在照片上绘制黑色细实线边框
+            self.canvas.create_rectangle(
+                preview_x, preview_y,
+                preview_x + photo.width,
+                preview_y + photo.height,
+                outline='black',
+                width=1  # 设置线条宽度为1像素
+            )
         
     def save_print_layout(self):
-        # 创建实际尺寸的打印图像（使用实际DPI）
-        paper_width_px = int(self.paper_size["width_mm"] * self.paper_size["dpi"] / 25.4)
-        paper_height_px = int(self.paper_size["height_mm"] * self.paper_size["dpi"] / 25.4)
-        
-        # 创建白色背景的图像
-        print_image = Image.new('RGB', 
-                              (paper_width_px, paper_height_px),
-                              'white')
-        
-        # 计算实际照片尺寸（像素）
-        photo_width_px = int(self.id_photo_spec["width_mm"] * self.paper_size["dpi"] / 25.4)
-        photo_height_px = int(self.id_photo_spec["height_mm"] * self.paper_size["dpi"] / 25.4)
-        
-        # 获取照片位置（毫米）
-        positions = self.layout.get_photo_positions(self.num_photos)
-        
-        # 创建绘图对象用于画边框
-        draw = ImageDraw.Draw(print_image)
-        
-        # 在每个位置粘贴照片并画边框
-        for i, (x_mm, y_mm) in enumerate(positions):
-            if i < self.num_photos:
-                # 转换位置为像素
-                x_px = int(x_mm * self.paper_size["dpi"] / 25.4)
-                y_px = int(y_mm * self.paper_size["dpi"] / 25.4)
-                
-                # 调整原始照片到正确尺寸
-                photo_resized = self.original_photo.resize(
-                    (photo_width_px, photo_height_px),
-                    Image.Resampling.LANCZOS
-                )
-                
-                # 粘贴照片
-                print_image.paste(photo_resized, (x_px, y_px))
-                
-                # 画黑色边框
-                draw.rectangle(
-                    [x_px, y_px, 
-                     x_px + photo_width_px - 1,  # -1 避免边框重叠
-                     y_px + photo_height_px - 1],
-                    outline='black',
-                    width=1
-                )
-        
-        # 保存图像
+        # 保存图像，TIFF 以外的格式按导出配置编码
+        extension = profile_extension(self.export_profile) if self.export_profile else ".jpg"
+        file_type = self.export_profile["format"] if self.export_profile else "JPEG"
         save_path = filedialog.asksaveasfilename(
-            defaultextension=".jpg",
-            filetypes=[("JPEG files", "*.jpg")],
-            initialfile="print_layout.jpg"
+            defaultextension=extension,
+            filetypes=[(f"{file_type} files", f"*{extension}"), ("TIFF files", "*.tif")],
+            initialfile=f"print_layout{extension}"
         )
+        if not save_path:
+            return
         
-        if save_path:
-            # 保存高质量图片
-            print_image.save(save_path, "JPEG", quality=95, dpi=(300, 300))
-            messagebox.showinfo("Success", "Print layout saved successfully!")
+        # 排版和编码在后台线程完成，避免窗口卡住
+        self.save_button.config(state='disabled')
+        self.tasks.submit(
+            "print_layout", "Saving print layout",
+            self.render_and_save, save_path, int(self.dpi_var.get()),
+            on_done=self.on_print_layout_saved,
+            on_error=self.on_print_layout_failed
+        )
+
+    def render_and_save(self, save_path, dpi):
+        """在后台线程中生成实际 DPI 的排版并保存"""
+        placements = print_placements(
+            self.original_photo, self.paper_size, self.id_photo_spec,
+            self.num_photos, self.layout
+        )
+        with telemetry.span("save_sheet", dpi=dpi):
+            save_sheet(save_path, self.paper_size, placements, dpi, profile=self.export_profile)
+
+    def on_print_layout_saved(self, result):
+        self.tasks.status_label.config(text="Print layout saved successfully", fg="green")
+        messagebox.showinfo("Success", "Print layout saved successfully!")
+        # 保存期间预览窗口可能已经被关闭
+        if self.preview_window.winfo_exists():
             self.preview_window.destroy()  # 关闭预览窗口
 
+    def on_print_layout_failed(self, error):
+        self.tasks.status_label.config(text=f"Saving print layout failed: {error}", fg="red")
+        if self.preview_window.winfo_exists():
+            self.save_button.config(state='normal')
+
 class PhotoEditor:
+    # 国家和证件类型筛选框中表示不限制的选项
+    ALL_FILTER = "All"
+    # 交互过程中使用的快速重采样滤镜
+    INTERACTIVE_RESAMPLE = Image.Resampling.BILINEAR
+    # 输入停止多久（毫秒）后用 LANCZOS 重新渲染
+    SETTLE_DELAY_MS = 150
+    # 撤销历史的最大步数和渲染缓存的内存预算（MB）
+    HISTORY_LIMIT = 100
+    RENDER_CACHE_MB = 64
+
     def __init__(self, root):
         self.root = root
         self.root.title("ID Photo Editor")
@@ -227,19 +275,42 @@ class PhotoEditor:
         # Initialize photo configuration
         self.photo_config = PhotoConfig()
         self.current_spec = None
+        self.current_geometry = None
         
         # Initialize variables
-        self.canvas_width = 800
-        self.canvas_height = 1000
-        self.image = None
+        self.canvas_width, self.canvas_height = CANVAS_SIZE
+        self.source = None
+        self.pyramid = None
+        self.tasks = None
+        self.histogram = None
+        self.adjustment_lut = None
         self.image_on_canvas = None
         self.image_offset_x = self.canvas_width // 2
         self.image_offset_y = self.canvas_height // 2
         self.scale = 1.0
         self.start_x = self.start_y = 0
+        
+        # 拖动/滚轮/滑块事件合并到每个空闲周期处理一次
+        self.pending_dx = self.pending_dy = 0
+        self.render_pending = False
+        self.redraw_job = None
+        self.settle_job = None
         self.brightness = 1.0
         self.contrast = 1.0
         
+        # 启用 ID_PHOTO_TELEMETRY 时在状态栏显示帧时间，F12 切换
+        self.telemetry_readout = telemetry.ENABLED
+        
+        # 自动调整模式下检测到的人脸位置（原图坐标）
+        self.face_landmarks = None
+        
+        # 背景掩码，在预览图上分割，显示和导出时放大使用
+        self.background_mask = None
+        
+        # 撤销/重做只记录参数，渲染好的缓冲图按参数缓存
+        self.history = EditHistory(self.HISTORY_LIMIT)
+        self.render_cache = RenderCache(self.RENDER_CACHE_MB)
+        
         # 添加调整模式变量
         self.adjustment_mode = tk.StringVar()
         self.adjustment_mode.set("Manual Adjustment")  # 默认为手动模式
@@ -256,9 +327,16 @@ class PhotoEditor:
         self.status_label = tk.Label(root, text="请上传图片", fg="black")
         self.status_label.pack(side="bottom", pady=5)
         
+        # 解码、导出等耗时操作在后台线程执行
+        self.tasks = BackgroundTasks(root, self.status_label)
+        
         # Add keyboard shortcuts
         self.root.bind('<Control-o>', lambda e: self.upload_image())
         self.root.bind('<Control-s>', lambda e: self.save_cropped_image())
+        self.root.bind('<Control-z>', lambda e: self.undo())
+        self.root.bind('<Control-y>', lambda e: self.redo())
+        self.root.bind('<Control-Z>', lambda e: self.redo())
+        self.root.bind('<F12>', lambda e: self.toggle_telemetry_readout())
         
         # 设置默认为美国护照
         self.type_var.set("US Passport")
@@ -277,6 +355,9 @@ class PhotoEditor:
         self.canvas.bind("<B1-Motion>", self.move_image)
         self.canvas.bind("<ButtonPress-1>", self.start_move)
         self.canvas.bind("<MouseWheel>", self.zoom_image)
+        
+        # 裁剪框和辅助线只创建一次，之后只更新坐标
+        self.create_overlay()
 
     def setup_ui(self):
         # Create control frame
@@ -287,15 +368,36 @@ class PhotoEditor:
         type_frame = tk.Frame(control_frame)
         type_frame.pack(fill='x', pady=5)
         
-        tk.Label(type_frame, text="Document Type:").pack(side='left')
+        # 按国家和证件类型筛选规格列表
+        tk.Label(type_frame, text="Country:").pack(side='left')
+        self.country_var = tk.StringVar(value=self.ALL_FILTER)
+        country_combo = ttk.Combobox(type_frame,
+                                     textvariable=self.country_var,
+                                     values=[self.ALL_FILTER] + PhotoConfig.CATALOG.countries(),
+                                     state='readonly',
+                                     width=6)
+        country_combo.pack(side='left', padx=5)
+        country_combo.bind('<<ComboboxSelected>>', self.filter_specs)
+        
+        tk.Label(type_frame, text="Document:").pack(side='left', padx=(10, 0))
+        self.document_var = tk.StringVar(value=self.ALL_FILTER)
+        document_combo = ttk.Combobox(type_frame,
+                                      textvariable=self.document_var,
+                                      values=[self.ALL_FILTER] + PhotoConfig.CATALOG.documents(),
+                                      state='readonly',
+                                      width=12)
+        document_combo.pack(side='left', padx=5)
+        document_combo.bind('<<ComboboxSelected>>', self.filter_specs)
+        
+        tk.Label(type_frame, text="Document Type:").pack(side='left', padx=(10, 0))
         self.type_var = tk.StringVar()
-        type_combo = ttk.Combobox(type_frame, 
+        self.type_combo = ttk.Combobox(type_frame, 
                                  textvariable=self.type_var,
                                  values=list(PhotoConfig.SPECIFICATIONS.keys()),
                                  state='readonly')
-        type_combo.pack(side='left', padx=5)
-        type_combo.set("P.R.China Passport")  # Default selection
-        type_combo.bind('<<ComboboxSelected>>', self.update_photo_spec)
+        self.type_combo.pack(side='left', padx=5)
+        self.type_combo.set("P.R.China Passport")  # Default selection
+        self.type_combo.bind('<<ComboboxSelected>>', self.update_photo_spec)
         
         # Buttons
         button_frame = tk.Frame(control_frame)
@@ -304,21 +406,59 @@ class PhotoEditor:
         tk.Button(button_frame, text="Upload Image", command=self.upload_image).pack(side="left", padx=5)
         tk.Button(button_frame, text="Save Photo", command=self.save_cropped_image).pack(side="left", padx=5)
         
+        # 导出配置：格式、压缩参数和文件大小限制
+        tk.Label(button_frame, text="Export Profile:").pack(side='left', padx=(15, 0))
+        self.export_profile_var = tk.StringVar()
+        profile_combo = ttk.Combobox(button_frame,
+                                     textvariable=self.export_profile_var,
+                                     values=list(PhotoConfig.EXPORT_PROFILES.keys()),
+                                     state='readonly')
+        profile_combo.set(PhotoConfig.DEFAULT_EXPORT_PROFILE)
+        profile_combo.pack(side='left', padx=5)
+        
         # Initialize photo specifications
         self.update_photo_spec()
 
+    def filter_specs(self, event=None):
+        """按所选国家和证件类型更新规格列表，当前规格被筛掉时改用第一个"""
+        country = self.country_var.get()
+        document = self.document_var.get()
+        names = PhotoConfig.CATALOG.find(
+            country=None if country == self.ALL_FILTER else country,
+            document=None if document == self.ALL_FILTER else document,
+        )
+        self.type_combo.config(values=names)
+        if names and self.type_var.get() not in names:
+            self.type_var.set(names[0])
+            self.update_photo_spec()
+
     def update_photo_spec(self, event=None):
+        self.apply_spec(self.type_var.get())
+
+        # 替换背景时预览使用规格的背景色，规格变化后需要重新渲染
+        if self.background_mask is not None and self.replace_background_var.get():
+            self.render_pending = True
+            self.schedule_redraw()
+
+        # 自动调整模式下按新规格重新定位
+        if self.adjustment_mode.get() == "Auto Adjustment" and self.face_landmarks:
+            self.apply_auto_fit()
+        else:
+            self.record_state()
+
+    def apply_spec(self, spec_name):
         # Get selected document type specifications
-        spec = PhotoConfig.SPECIFICATIONS[self.type_var.get()]
+        spec = PhotoConfig.SPECIFICATIONS[spec_name]
         self.current_spec = spec
         
-        # Calculate crop box dimensions (mm to pixels)
-        self.target_width_px = int(spec["width_mm"] * spec["dpi"] / 25.4)
-        self.target_height_px = int(spec["height_mm"] * spec["dpi"] / 25.4)
+        # 裁剪框像素尺寸和辅助线偏移在加载规格目录时已经算好
+        self.current_geometry = PhotoConfig.CATALOG.geometry[spec_name]
+        self.target_width_px, self.target_height_px = self.current_geometry["pixel_size"]
         
         # Set minimum recommended resolution
         self.min_width = self.target_width_px * 2
         self.min_height = self.target_height_px * 2
+        self.cancel_stale_export()
         
         # Update crop box
         self.draw_crop_box()
@@ -328,89 +468,314 @@ class PhotoEditor:
         if not file_path:
             return
 
-        # Open original image
-        original = Image.open(file_path)
-        
-        # Create white background
-        white_bg = Image.new("RGB", original.size, (255, 255, 255))
+        # 新图片使之前尚未完成的解码和导出全部作废
+        self.tasks.cancel("load", "full_resolution", "crop", "auto_adjust", "background")
         
-        # Handle transparent background
-        if original.mode in ('RGBA', 'LA') or (original.mode == 'P' and 'transparency' in original.info):
-            white_bg.paste(original, (0, 0), original)
-            self.original_image = white_bg
-        else:
-            self.original_image = original.convert("RGB")
+        # 释放上一张图片及其金字塔
+        self.pyramid = None
+        self.source = None
+        self.face_landmarks = None
+        self.background_mask = None
+        self.render_cache.clear()
+        if self.image_on_canvas:
+            self.canvas.delete(self.image_on_canvas)
+            self.image_on_canvas = None
+
+        self.tasks.submit("load", "Loading image", self.open_source, file_path,
+                          on_done=self.on_image_loaded)
+
+    @staticmethod
+    def open_source(file_path):
+        """在后台线程中打开图片，JPEG 先按预览尺寸快速解码"""
+        source = SourceImage(file_path)
+        pyramid = ImagePyramid(source.preview, source.size)
+        return source, pyramid, source.preview.histogram()
+
+    def on_image_loaded(self, result):
+        self.source, self.pyramid, self.histogram = result
+        width, height = self.source.size
 
         # Check image resolution
-        if self.original_image.size[0] < self.min_width or self.original_image.size[1] < self.min_height:
+        if width < self.min_width or height < self.min_height:
             self.status_label.config(
                 text=f"Warning: Recommended resolution is at least {self.min_width}x{self.min_height} pixels",
                 fg="red"
             )
         else:
-            self.status_label.config(text="Image loaded successfully", fg="green")
+            self.status_label.config(
+                text=f"Image loaded successfully (image buffers {self.buffer_footprint_mb():.0f} MB)",
+                fg="green"
+            )
 
-        self.image = self.original_image.copy()
+        # 直方图用于计算对比度调整所需的灰度均值
+        self.update_adjustment_lut()
         
         # Reset scale and position
         self.scale = 1.0
         self.image_offset_x = self.canvas_width // 2
         self.image_offset_y = self.canvas_height // 2
+        self.history.reset(self.edit_state())
         self.show_image()
+        
+        # 预览分辨率不够时，稍后在高质量渲染时再完整解码
+        if not self.source.is_full_resolution:
+            if self.settle_job is not None:
+                self.root.after_cancel(self.settle_job)
+            self.settle_job = self.root.after(self.SETTLE_DELAY_MS, self.settle_render)
+        
+        if self.adjustment_mode.get() == "Auto Adjustment":
+            self.auto_adjust()
+        if self.replace_background_var.get():
+            self.update_background()
 
-    def show_image(self):
-        if self.image:
-            # Resize image based on scale
-            w, h = self.image.size
-            resized_image = self.image.resize(
-                (int(w * self.scale), int(h * self.scale)), 
-                Image.Resampling.LANCZOS
-            )
+    def request_full_resolution(self):
+        """在后台完整解码原图，完成后用它重建金字塔和直方图"""
+        if not self.source or self.pyramid.levels[0] is self.source.full_image or self.tasks.is_running("full_resolution"):
+            return
+        self.tasks.submit("full_resolution", "Decoding full resolution",
+                          self.decode_full_resolution, self.source,
+                          on_done=self.on_full_resolution_loaded)
+
+    @staticmethod
+    def decode_full_resolution(source):
+        image = source.load_full()
+        # 超出内存预算时 image 已被缩小，金字塔仍以原图尺寸为坐标
+        return source, ImagePyramid(image, source.size), image.histogram()
+
+    def on_full_resolution_loaded(self, result):
+        source, pyramid, histogram = result
+        if source is not self.source:
+            return
+        self.pyramid = pyramid
+        self.histogram = histogram
+        self.render_cache.clear()
+        self.update_adjustment_lut()
+        if source.is_reduced:
+            width, height = source.full_image.size
+            text = f"Reduced to {width}x{height} to fit the memory budget"
+        else:
+            text = "Full resolution loaded"
+        self.status_label.config(text=f"{text} (image buffers {self.buffer_footprint_mb():.0f} MB)",
+                                 fg="green")
+        self.show_image()
+
+    def show_image(self, resample=Image.Resampling.LANCZOS):
+        # 直接重绘后，尚未处理的合并事件已经包含在本次渲染中
+        self.pending_dx = self.pending_dy = 0
+        self.render_pending = False
 
-            # Convert to Tkinter image
-            self.tk_image = ImageTk.PhotoImage(resized_image)
+        if not self.pyramid:
+            return
+
+        with telemetry.span("show_image", resample=resample.name):
+            # 高质量渲染的结果按参数缓存，撤销和重做时直接复用
+            key = self.render_key()
+            cached = self.render_cache.get(key)
+            if cached is not None:
+                visible_image, position = cached
+            else:
+                visible_image, position = self.render_visible_image(resample)
+                if visible_image is not None and resample == Image.Resampling.LANCZOS:
+                    self.render_cache.put(key, visible_image, position)
 
             # Update canvas
-            if self.image_on_canvas:
-                self.canvas.delete(self.image_on_canvas)
-            self.image_on_canvas = self.canvas.create_image(
-                self.image_offset_x, 
-                self.image_offset_y, 
-                anchor='center', 
-                image=self.tk_image
+            if visible_image is None:
+                if self.image_on_canvas:
+                    self.canvas.delete(self.image_on_canvas)
+                    self.image_on_canvas = None
+            else:
+                # Convert to Tkinter image
+                with telemetry.span("photoimage"):
+                    self.tk_image = ImageTk.PhotoImage(visible_image)
+                if self.image_on_canvas:
+                    # 复用同一个画布项，裁剪框和辅助线保持在图片上方，不需要重绘
+                    self.canvas.itemconfig(self.image_on_canvas, image=self.tk_image)
+                    self.canvas.coords(self.image_on_canvas, position[0], position[1])
+                else:
+                    self.image_on_canvas = self.canvas.create_image(
+                        position[0],
+                        position[1],
+                        anchor='nw',
+                        image=self.tk_image
+                    )
+                    self.canvas.tag_lower(self.image_on_canvas)
+
+        if self.telemetry_readout:
+            self.status_label.config(
+                text=f"{telemetry.frame_times.summary()}, image buffers {self.buffer_footprint_mb():.0f} MB",
+                fg="black"
             )
 
-            # Update crop box
-            self.draw_crop_box()
+    def buffer_footprint_mb(self):
+        """当前持有的全部图像缓冲区（原图、金字塔、掩码、渲染缓存）的大小"""
+        images = [self.background_mask]
+        if self.source:
+            images += [self.source.preview, self.source.full_image]
+        if self.pyramid:
+            images += self.pyramid.levels
+        images += [image for image, _ in self.render_cache.entries.values()]
+        return image_buffer_bytes(*images) / (1024 * 1024)
 
-            # 在显示图片后重绘辅助线
-            self.draw_guide_lines()
+    def toggle_telemetry_readout(self):
+        if not telemetry.ENABLED:
+            self.status_label.config(text="Set ID_PHOTO_TELEMETRY=1 to record frame times", fg="black")
+            return
+        self.telemetry_readout = not self.telemetry_readout
 
-    def draw_crop_box(self):
-        # Remove old mask and box
-        self.canvas.delete("crop_box")
+    def render_visible_image(self, resample):
+        # 只渲染画布可见区域，耗时只与画布大小相关
+        level = self.pyramid.levels[self.pyramid.level_index(self.scale)]
+        with telemetry.span("resize", resample=resample.name):
+            visible_image, position = render_viewport(
+                level,
+                self.scale,
+                (self.image_offset_x, self.image_offset_y),
+                (self.canvas_width, self.canvas_height),
+                resample,
+                full_size=self.pyramid.full_size
+            )
+        if visible_image is None:
+            return None, position
+        
+        # 亮度和对比度只作用于显示用的缓冲图
+        if self.adjustment_lut:
+            with telemetry.span("adjust"):
+                visible_image = apply_lut(visible_image, self.adjustment_lut)
         
+        # 背景替换同样只作用于缓冲图
+        if self.replace_background_var.get() and self.background_mask is not None:
+            with telemetry.span("composite_background"):
+                visible_image = self.composite_visible_background(visible_image)
+        return visible_image, position
+
+    def composite_visible_background(self, visible_image):
+        """背景掩码按与缓冲图相同的视口放大，再合成规格的背景色"""
+        mask_image, _ = render_viewport(
+            self.background_mask,
+            self.scale,
+            (self.image_offset_x, self.image_offset_y),
+            (self.canvas_width, self.canvas_height),
+            Image.Resampling.BILINEAR,
+            full_size=self.pyramid.full_size
+        )
+        upscale = self.scale * self.pyramid.full_size[0] / self.background_mask.width
+        return composite_background(
+            visible_image, feather_mask(mask_image, upscale),
+            self.current_spec["bg_color"]
+        )
+
+    def render_key(self):
+        """决定视口缓冲图内容的全部参数"""
+        bg_color = None
+        if self.replace_background_var.get() and self.background_mask is not None:
+            bg_color = self.current_spec["bg_color"]
+        return (self.scale, self.image_offset_x, self.image_offset_y,
+                self.brightness, self.contrast, bg_color)
+
+    def edit_state(self):
+        return {
+            "spec": self.type_var.get(),
+            "scale": self.scale,
+            "offset": (self.image_offset_x, self.image_offset_y),
+            "brightness": self.brightness,
+            "contrast": self.contrast,
+        }
+
+    def record_state(self):
+        """输入停止后记录当前参数，与上一个状态相同时不记录"""
+        if self.source:
+            self.history.push(self.edit_state())
+
+    def undo(self):
+        if not self.source:
+            return
+        # 尚未记录的输入先记录下来，撤销回到这次输入之前
+        self.record_state()
+        state = self.history.undo()
+        if state is None:
+            self.status_label.config(text="Nothing to undo", fg="black")
+            return
+        self.restore_state(state)
+
+    def redo(self):
+        if not self.source:
+            return
+        self.record_state()
+        state = self.history.redo()
+        if state is None:
+            self.status_label.config(text="Nothing to redo", fg="black")
+            return
+        self.restore_state(state)
+
+    def restore_state(self, state):
+        """恢复历史中的参数并立即重绘，缓存命中时不需要重新渲染"""
+        for job in (self.redraw_job, self.settle_job):
+            if job is not None:
+                self.root.after_cancel(job)
+        self.redraw_job = self.settle_job = None
+        
+        if state["spec"] != self.type_var.get():
+            self.type_var.set(state["spec"])
+            self.apply_spec(state["spec"])
+        self.scale = state["scale"]
+        self.image_offset_x, self.image_offset_y = state["offset"]
+        self.brightness = state["brightness"]
+        self.contrast = state["contrast"]
+        self.brightness_scale.set(self.brightness)
+        self.contrast_scale.set(self.contrast)
+        self.update_adjustment_lut()
+        self.cancel_stale_export()
+        self.show_image()
+
+    def create_overlay(self):
+        """创建裁剪框遮罩、边框和辅助线画布项，坐标由 draw_crop_box 设置"""
+        # Dark overlay，裁剪框上下左右四块
+        self.crop_mask_items = [
+            self.canvas.create_rectangle(0, 0, 0, 0, fill="black", stipple="gray25",
+                                         tags="crop_box")
+            for _ in range(4)
+        ]
+        # Crop box border
+        self.crop_border_item = self.canvas.create_rectangle(
+            0, 0, 0, 0, outline="white", width=2, tags="crop_box")
+        
+        # 辅助线：垂直居中线（白）、眼睛范围（绿，两条）、头部范围（黄，四条）
+        dash_pattern = (5, 5)  # 5像素线段，5像素空格
+        self.center_line_item = self.canvas.create_line(
+            0, 0, 0, 0, dash=dash_pattern, fill='white', tags="guide_lines")
+        self.eye_line_items = [
+            self.canvas.create_line(0, 0, 0, 0, dash=dash_pattern, fill='green',
+                                    tags="guide_lines")
+            for _ in range(2)
+        ]
+        self.head_line_items = [
+            self.canvas.create_line(0, 0, 0, 0, dash=dash_pattern, fill='yellow',
+                                    tags="guide_lines")
+            for _ in range(4)
+        ]
+
+    def draw_crop_box(self):
+        """按当前规格移动裁剪框，只在规格或画布尺寸变化时调用"""
         # Calculate crop box position
-        x1 = (self.canvas_width - self.target_width_px) // 2
-        y1 = (self.canvas_height - self.target_height_px) // 2
+        x1, y1 = crop_box_position((self.canvas_width, self.canvas_height),
+                                   (self.target_width_px, self.target_height_px))
         x2 = x1 + self.target_width_px
         y2 = y1 + self.target_height_px
         
-        # Draw dark overlay
-        self.canvas.create_rectangle(0, 0, self.canvas_width, y1, 
-                                   fill="black", stipple="gray25", tags="crop_box")
-        self.canvas.create_rectangle(0, y2, self.canvas_width, self.canvas_height, 
-                                   fill="black", stipple="gray25", tags="crop_box")
-        self.canvas.create_rectangle(0, y1, x1, y2, 
-                                   fill="black", stipple="gray25", tags="crop_box")
-        self.canvas.create_rectangle(x2, y1, self.canvas_width, y2, 
-                                   fill="black", stipple="gray25", tags="crop_box")
-        
-        # Draw crop box border
-        self.canvas.create_rectangle(x1, y1, x2, y2, 
-                                   outline="white", width=2, tags="crop_box")
-
-        # 在绘制完裁剪框后添加辅助线
+        # Dark overlay
+        mask_coords = [
+            (0, 0, self.canvas_width, y1),
+            (0, y2, self.canvas_width, self.canvas_height),
+            (0, y1, x1, y2),
+            (x2, y1, self.canvas_width, y2),
+        ]
+        for item, coords in zip(self.crop_mask_items, mask_coords):
+            self.canvas.coords(item, *coords)
+        
+        # Crop box border
+        self.canvas.coords(self.crop_border_item, x1, y1, x2, y2)
+
+        # 裁剪框移动后辅助线随之移动
         self.draw_guide_lines()
 
     def start_move(self, event):
@@ -424,79 +789,86 @@ class PhotoEditor:
         self.image_offset_x += dx
         self.image_offset_y += dy
         self.start_x, self.start_y = event.x, event.y
-        self.show_image()
+        self.cancel_stale_export()
+        
+        # 平移只移动画布上已有的图片，不重新渲染
+        self.pending_dx += dx
+        self.pending_dy += dy
+        self.schedule_redraw()
 
     def zoom_image(self, event):
         # Control zoom scale
         zoom_factor = 1.1 if event.delta > 0 else 0.9
         self.scale *= zoom_factor
+        self.cancel_stale_export()
+        self.render_pending = True
+        self.schedule_redraw()
+
+    def schedule_redraw(self):
+        """合并连续的输入事件，每个空闲周期只重绘一次，并在输入停止后高质量重绘"""
+        if self.redraw_job is None:
+            self.redraw_job = self.root.after_idle(self.flush_redraw)
+        
+        if self.settle_job is not None:
+            self.root.after_cancel(self.settle_job)
+        self.settle_job = self.root.after(self.SETTLE_DELAY_MS, self.settle_render)
+
+    def flush_redraw(self):
+        self.redraw_job = None
+        if self.render_pending:
+            # 缩放或调整参数变化时用快速滤镜重新渲染
+            self.show_image(self.INTERACTIVE_RESAMPLE)
+        elif self.pending_dx or self.pending_dy:
+            if self.image_on_canvas:
+                self.canvas.move(self.image_on_canvas, self.pending_dx, self.pending_dy)
+            self.pending_dx = self.pending_dy = 0
+
+    def settle_render(self):
+        """输入停止后用 LANCZOS 重新渲染，同时补齐平移后露出的区域"""
+        self.settle_job = None
+        if self.redraw_job is not None:
+            self.root.after_cancel(self.redraw_job)
+            self.redraw_job = None
+        
+        # 当前缩放超出预览图的分辨率时才完整解码
+        if self.source and self.source.size[0] * self.scale > self.pyramid.levels[0].width:
+            self.request_full_resolution()
         self.show_image()
+        self.record_state()
 
     def save_cropped_image(self):
-        if not self.image:
+        if not self.source:
             self.status_label.config(text="Please upload an image first", fg="red")
             return
 
-        # 获取调整后的图片
-        w, h = self.original_image.size
-        
-        # 先应用亮度和对比度调整
-        adjusted_image = self.original_image.copy()
-        enhancer = ImageEnhance.Brightness(adjusted_image)
-        adjusted_image = enhancer.enhance(self.brightness)
-        enhancer = ImageEnhance.Contrast(adjusted_image)
-        adjusted_image = enhancer.enhance(self.contrast)
-        
-        # 进行缩放
-        resized_image = adjusted_image.resize(
-            (int(w * self.scale), int(h * self.scale)), 
-            Image.Resampling.LANCZOS
-        )
-
-        # 创建白色背景图片
-        final_image = Image.new(
-            "RGB", 
-            (self.target_width_px, self.target_height_px), 
-            self.current_spec["bg_color"]
-        )
-
-        # 计算裁剪位置
-        crop_x1 = (self.canvas_width - self.target_width_px) / 2
-        crop_y1 = (self.canvas_height - self.target_height_px) / 2
-        
-        # 向上取整以避免缝隙
-        crop_x2 = math.ceil(crop_x1 + self.target_width_px)
-        crop_y2 = math.ceil(crop_y1 + self.target_height_px)
-
-        # 转换为图片坐标
-        x1 = int((crop_x1 - (self.image_offset_x - resized_image.width / 2)))
-        y1 = int((crop_y1 - (self.image_offset_y - resized_image.height / 2)))
-        x2 = int((crop_x2 - (self.image_offset_x - resized_image.width / 2)))
-        y2 = int((crop_y2 - (self.image_offset_y - resized_image.height / 2)))
-
-        # 计算实际粘贴区域，使用 math.ceil 确保没有缝隙
-        paste_x = int(max(0, -x1))
-        paste_y = int(max(0, -y1))
-        crop_x = int(max(0, x1))
-        crop_y = int(max(0, y1))
-        crop_right = math.ceil(min(resized_image.width, x2))
-        crop_bottom = math.ceil(min(resized_image.height, y2))
-
-        # 如果有可见的图像区域
-        if crop_right > crop_x and crop_bottom > crop_y:
-            # 裁剪可见部分
-            cropped = resized_image.crop((crop_x, crop_y, crop_right, crop_bottom))
-            # 粘贴到白色背景上
-            final_image.paste(cropped, (paste_x, paste_y))
-
-        # 保存图片
+        # 保存图片，格式由导出配置决定
+        profile = export_profile(self.export_profile_var.get())
+        extension = profile_extension(profile)
         save_path = filedialog.asksaveasfilename(
-            defaultextension=".jpg",
-            filetypes=[("JPEG files", "*.jpg")]
+            defaultextension=extension,
+            filetypes=[(f"{profile['format']} files", f"*{extension}")]
         )
         if save_path:
-            final_image.save(save_path, quality=95)
-            self.status_label.config(text="Photo saved successfully", fg="green")
+            dpi = self.current_spec["dpi"]
+            self.get_cropped_photo(
+                lambda final_image: self.tasks.submit(
+                    "export", "Encoding photo", self.encode_and_write,
+                    final_image, save_path, profile, dpi,
+                    on_done=self.on_cropped_photo_saved
+                )
+            )
+
+    @staticmethod
+    def encode_and_write(image, save_path, profile, dpi):
+        """在后台线程中按导出配置编码（可能多次编码以满足大小限制）并写入文件"""
+        with telemetry.span("encode_photo"):
+            data = encode_image(image, profile, dpi)
+        with open(save_path, "wb") as f:
+            f.write(data)
+        return len(data)
+
+    def on_cropped_photo_saved(self, size):
+        self.status_label.config(text=f"Photo saved successfully ({size / 1024:.0f} KB)", fg="green")
 
     def add_adjustment_controls(self):
         # Create adjustment frame
@@ -530,26 +902,49 @@ class PhotoEditor:
         )
         self.contrast_scale.set(1.0)
         self.contrast_scale.pack(side='left', padx=5)
+        
+        # 背景替换为规格要求的颜色
+        self.replace_background_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(adjust_frame,
+                      text="Replace Background",
+                      variable=self.replace_background_var,
+                      command=self.update_background).pack(side='left', padx=10)
+
+    def update_background(self):
+        if not self.source:
+            return
+        self.cancel_stale_export()
+        if self.replace_background_var.get() and self.background_mask is None:
+            self.tasks.submit("background", "Detecting background",
+                              background_mask, self.source.preview,
+                              on_done=self.on_background_mask)
+            return
+        self.render_pending = True
+        self.schedule_redraw()
+
+    def on_background_mask(self, mask):
+        self.background_mask = mask
+        self.render_cache.clear()
+        self.render_pending = True
+        self.schedule_redraw()
 
     def update_adjustments(self, event=None):
-        if hasattr(self, 'original_image'):
+        if self.source:
             # Get current adjustment values
             self.brightness = self.brightness_scale.get()
             self.contrast = self.contrast_scale.get()
+            self.cancel_stale_export()
             
-            # Apply adjustments
-            img = self.original_image.copy()
-            
-            # Apply brightness
-            enhancer = ImageEnhance.Brightness(img)
-            img = enhancer.enhance(self.brightness)
-            
-            # Apply contrast
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(self.contrast)
-            
-            self.image = img
-            self.show_image()
+            self.update_adjustment_lut()
+            self.render_pending = True
+            self.schedule_redraw()
+
+    def update_adjustment_lut(self):
+        """根据当前亮度和对比度更新查找表，不需要调整时为 None"""
+        if self.brightness == 1.0 and self.contrast == 1.0:
+            self.adjustment_lut = None
+        else:
+            self.adjustment_lut = adjustment_lut(self.brightness, self.contrast, self.histogram)
 
     def add_mode_switch(self):
         # 创建模式切换框架
@@ -561,65 +956,77 @@ class PhotoEditor:
                       text="Manual Adjustment",
                       variable=self.adjustment_mode,
                       value="Manual Adjustment",
-                      command=self.update_guide_lines).pack(side='left', padx=10)
+                      command=self.update_adjustment_mode).pack(side='left', padx=10)
                       
         tk.Radiobutton(mode_frame, 
                       text="Auto Adjustment",
                       variable=self.adjustment_mode,
                       value="Auto Adjustment",
-                      command=self.update_guide_lines).pack(side='left', padx=10)
+                      command=self.update_adjustment_mode).pack(side='left', padx=10)
+
+    def update_adjustment_mode(self):
+        self.update_guide_lines()
+        if self.adjustment_mode.get() == "Auto Adjustment":
+            self.auto_adjust()
+
+    def auto_adjust(self):
+        """在后台线程中定位人脸，完成后按当前规格自动设置缩放和位置"""
+        if not self.source:
+            return
+        if self.face_landmarks:
+            self.apply_auto_fit()
+            return
+        
+        # 在预览图上检测即可，坐标换算到原图
+        self.tasks.submit("auto_adjust", "Detecting face",
+                          locate_face, self.source.preview, self.source.size,
+                          on_done=self.on_face_located)
+
+    def on_face_located(self, landmarks):
+        if landmarks is None:
+            self.status_label.config(text="No face detected, please adjust manually", fg="red")
+            return
+        self.face_landmarks = landmarks
+        self.apply_auto_fit()
+        self.status_label.config(text="Photo adjusted automatically", fg="green")
+
+    def apply_auto_fit(self):
+        self.scale, (self.image_offset_x, self.image_offset_y) = auto_fit(
+            self.face_landmarks, self.current_spec, self.source.size,
+            (self.canvas_width, self.canvas_height)
+        )
+        self.pending_dx = self.pending_dy = 0
+        self.cancel_stale_export()
+        self.render_pending = True
+        self.schedule_redraw()
 
     def draw_guide_lines(self):
-        # 删除现有的辅助线
-        self.canvas.delete("guide_lines")
-        
-        if self.adjustment_mode.get() == "Manual Adjustment" and self.current_spec:
-            # 获取裁剪框的位置
-            x1 = (self.canvas_width - self.target_width_px) // 2
-            y1 = (self.canvas_height - self.target_height_px) // 2
-            x2 = x1 + self.target_width_px
-            y2 = y1 + self.target_height_px
-            
-            # 绘制垂直居中线
-            dash_pattern = (5, 5)  # 5像素线段，5像素空格
-            center_x = (x1 + x2) // 2
-            self.canvas.create_line(center_x, y1, center_x, y2,
-                                  dash=dash_pattern, fill='white',
-                                  tags="guide_lines")
-            
-            # 计算毫米到像素的换比例
-            mm_to_px = self.current_spec["dpi"] / 25.4
-            
-            # 绘制眼睛位置范围线（两条绿线）
-            eyes_min_y = y2 - int(self.current_spec["guide_lines"]["eyes_position_min"] * mm_to_px)
-            eyes_max_y = y2 - int(self.current_spec["guide_lines"]["eyes_position_max"] * mm_to_px)
-            
-            self.canvas.create_line(x1, eyes_min_y, x2, eyes_min_y,
-                                  dash=dash_pattern, fill='green',
-                                  tags="guide_lines")
-            self.canvas.create_line(x1, eyes_max_y, x2, eyes_max_y,
-                                  dash=dash_pattern, fill='green',
-                                  tags="guide_lines")
-            
-            # 以眼睛位置的中点为基准，绘制头部尺寸范围线
-            eyes_center_y = (eyes_min_y + eyes_max_y) / 2
-            head_min = self.current_spec["guide_lines"]["head_size_min"] * mm_to_px
-            head_max = self.current_spec["guide_lines"]["head_size_max"] * mm_to_px
-            
-            # 绘制头部范围的四条线（黄线）
-            # 最小头部尺寸的上下线（内侧两条线）
-            head_top_min = eyes_center_y - int(head_min * 0.4)  # 头顶位置（较小范围）
-            head_bottom_min = eyes_center_y + int(head_min * 0.6)  # 下巴位置（较小范围）
-            
-            # 最大头部尺寸的上下线（外侧两条线）
-            head_top_max = eyes_center_y - int(head_max * 0.4)  # 头顶位置（较大范围）
-            head_bottom_max = eyes_center_y + int(head_max * 0.6)  # 下巴位置（较大范围）
-            
-            # 绘制所有头部范围线
-            for y in [head_top_max, head_top_min, head_bottom_min, head_bottom_max]:
-                self.canvas.create_line(x1, y, x2, y,
-                                      dash=dash_pattern, fill='yellow',
-                                      tags="guide_lines")
+        """移动辅助线，只在手动模式下显示"""
+        if self.adjustment_mode.get() != "Manual Adjustment" or not self.current_spec:
+            self.canvas.itemconfig("guide_lines", state="hidden")
+            return
+        
+        # 获取裁剪框的位置
+        x1, y1 = crop_box_position((self.canvas_width, self.canvas_height),
+                                   (self.target_width_px, self.target_height_px))
+        x2 = x1 + self.target_width_px
+        y2 = y1 + self.target_height_px
+        
+        # 垂直居中线
+        center_x = (x1 + x2) // 2
+        self.canvas.coords(self.center_line_item, center_x, y1, center_x, y2)
+        
+        # 辅助线相对裁剪框底边的偏移由规格目录预先计算
+        offsets = self.current_geometry["guide_offsets"]
+        
+        # 眼睛位置范围线（两条绿线）
+        for item, offset in zip(self.eye_line_items, offsets["eyes"]):
+            self.canvas.coords(item, x1, y2 + offset, x2, y2 + offset)
+        
+        # 头部范围的四条线（黄线）：头顶最大、头顶最小、下巴最小、下巴最大
+        for item, offset in zip(self.head_line_items, offsets["head"]):
+            self.canvas.coords(item, x1, y2 + offset, x2, y2 + offset)
+        self.canvas.itemconfig("guide_lines", state="normal")
 
     def update_guide_lines(self):
         # 更新辅助线显示
@@ -654,77 +1061,71 @@ class PhotoEditor:
                  command=self.show_print_preview).pack(side='left', padx=5)
         
     def show_print_preview(self):
-        if not self.image:
+        if not self.source:
             self.status_label.config(text="Please upload an image first", fg="red")
             return
             
         # 获取裁剪后的照片（保持为PIL Image格式）
-        cropped_photo = self.get_cropped_photo()
-        if cropped_photo:
-            paper_size = PhotoConfig.PAPER_SIZES[self.paper_size_var.get()]
-            num_photos = int(self.num_photos_var.get())
-            
-            preview = PrintPreviewWindow(
-                self.root, 
-                cropped_photo,  # PIL Image 格式
-                paper_size, 
-                num_photos,
-                self.current_spec
-            )
-    
-    def get_cropped_photo(self):
-        """获取裁剪后的照片，返回PIL Image对象"""
-        if not self.image:
-            return None
-
-        # 获取调整后的图片
-        w, h = self.original_image.size
-        
-        # 应用亮度和对比度调整
-        adjusted_image = self.original_image.copy()
-        enhancer = ImageEnhance.Brightness(adjusted_image)
-        adjusted_image = enhancer.enhance(self.brightness)
-        enhancer = ImageEnhance.Contrast(adjusted_image)
-        adjusted_image = enhancer.enhance(self.contrast)
-        
-        # 进行缩放
-        resized_image = adjusted_image.resize(
-            (int(w * self.scale), int(h * self.scale)), 
-            Image.Resampling.LANCZOS
+        self.get_cropped_photo(self.open_print_preview)
+
+    def open_print_preview(self, cropped_photo):
+        paper_size = PhotoConfig.PAPER_SIZES[self.paper_size_var.get()]
+        num_photos = int(self.num_photos_var.get())
+        
+        preview = PrintPreviewWindow(
+            self.root, 
+            cropped_photo,  # PIL Image 格式
+            paper_size, 
+            num_photos,
+            self.current_spec,
+            self.tasks,
+            export_profile(self.export_profile_var.get())
         )
+    
+    def get_cropped_photo(self, on_done):
+        """在后台线程中裁剪照片，完成后在主线程调用 on_done(PIL Image)"""
+        if not self.source:
+            return
 
-        # 创建白色背景图片
-        final_image = Image.new(
-            "RGB", 
-            (self.target_width_px, self.target_height_px), 
-            self.current_spec["bg_color"]
+        # 记录当前参数，后台线程不读取任何 Tk 状态
+        source = self.source
+        histogram = self.histogram if self.pyramid.levels[0] is source.full_image else None
+        spec = self.current_spec
+        params = (
+            self.scale,
+            (self.image_offset_x, self.image_offset_y),
+            self.brightness,
+            self.contrast,
         )
+        canvas_size = (self.canvas_width, self.canvas_height)
+        replace_background = self.replace_background_var.get()
+        mask = self.background_mask
 
-        # 计算裁剪位置
-        crop_x1 = (self.canvas_width - self.target_width_px) / 2
-        crop_y1 = (self.canvas_height - self.target_height_px) / 2
-        
-        # 计算实际裁剪区域
-        x1 = int((crop_x1 - (self.image_offset_x - resized_image.width / 2)))
-        y1 = int((crop_y1 - (self.image_offset_y - resized_image.height / 2)))
-        x2 = int(x1 + self.target_width_px)
-        y2 = int(y1 + self.target_height_px)
-
-        # 计算粘贴位置
-        paste_x = max(0, -x1)
-        paste_y = max(0, -y1)
-        crop_x = max(0, x1)
-        crop_y = max(0, y1)
-        crop_right = min(resized_image.width, x2)
-        crop_bottom = min(resized_image.height, y2)
-
-        if crop_right > crop_x and crop_bottom > crop_y:
-            cropped = resized_image.crop((crop_x, crop_y, crop_right, crop_bottom))
-            final_image.paste(cropped, (paste_x, paste_y))
-            
-            return final_image  # 直接返回PIL Image对象，不转换为PhotoImage
-        return None
+        def render():
+            # 导出时使用完整分辨率的图像和直方图
+            with telemetry.span("decode_full"):
+                image = source.load_full()
+            background = None
+            if replace_background:
+                # 掩码还没有算好时在导出线程中计算
+                background = mask if mask is not None else background_mask(source.preview)
+            # 裁剪框映射回原图后一次重采样得到最终尺寸
+            with telemetry.span("crop_photo"):
+                return crop_photo(image, spec, *params, histogram, background, canvas_size,
+                                  source.size)
+
+        def finished(final_image):
+            # 导出时已经完整解码，顺便更新预览
+            self.request_full_resolution()
+            on_done(final_image)
+
+        self.tasks.submit("crop", "Rendering photo", render, on_done=finished)
 
+    def cancel_stale_export(self):
+        """参数变化后，正在进行的裁剪结果已经过时"""
+        if self.tasks and self.tasks.is_running("crop"):
+            self.tasks.cancel("crop")
+            self.status_label.config(text="Export cancelled because the photo was changed", fg="red")
 
 # Create and run application
 if __name__ == "__main__":
@@ -0,0 +1,279 @@
+"""本地证件照渲染服务
+
+基于 asyncio 的小型 HTTP 服务，请求体为原图，参数放在查询字符串中，字段与
+批处理清单相同（spec、scale、offset_x、offset_y、brightness、contrast、auto、
+replace_background、profile、paper、copies、dpi）。图像处理在进程池中完成，前端只负责
+收发数据，吞吐量随 CPU 核数增长。
+
+接口：
+    POST /crop     返回按导出配置（profile）编码的照片，默认 JPEG
+    POST /sheet    返回按 PrintLayout 排满的打印纸，format=tif 时返回 TIFF；
+                   copies 超过一张纸的容量时返回 400
+    GET  /health   服务状态
+    GET  /metrics  请求计数、排队情况和平均耗时
+
+同时处理的请求数不超过工作进程数，其余请求排队；排队数超过 --max-queue 时
+直接返回 503，客户端按 Retry-After 稍后重试。指定 --cache-dir 时，相同原图和
+参数的请求直接返回缓存的结果，可以与 batch_process 共用同一个缓存目录。
+
+用法：
+    python photo_service.py --port 8080 --workers 4 --max-queue 16 --cache-dir cache
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+from PIL import UnidentifiedImageError
+
+from batch_process import crop_entry, crop_key, sheet_options
+from photo_configs import PhotoConfig
+from export_profiles import CONTENT_TYPES, encode_image, export_profile
+from photo_core import PrintLayout, load_source_image, save_sheet
+from result_cache import ResultCache, data_digest
+
+# 请求体大小上限（MB）
+MAX_BODY_MB = 50
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+def render_crop_request(params, data, cache=None):
+    """在工作进程中裁剪照片，返回按导出配置编码的字节"""
+    profile = export_profile(params.get("profile"))
+    key = None
+    if cache is not None:
+        key = crop_key(params, data_digest(data), profile)
+        cached = cache.read(key)
+        if cached is not None:
+            return cached
+
+    photo, spec = crop_entry(params, load_source_image(io.BytesIO(data)))
+    body = encode_image(photo, profile, spec["dpi"])
+    if key:
+        cache.write(key, body)
+    return body
+
+
+def render_sheet_request(params, data, cache=None):
+    """在工作进程中裁剪照片并排版，返回打印纸的 JPEG 或 TIFF 字节"""
+    if not params.get("paper"):
+        raise ValueError("Missing paper")
+    if params.get("spec") not in PhotoConfig.SPECIFICATIONS:
+        raise ValueError(f"Unknown spec: {params.get('spec')}")
+    spec = PhotoConfig.SPECIFICATIONS[params["spec"]]
+    paper_size, copies, dpi = sheet_options(params, spec)
+    # 只返回一张纸，超出容量时报错，不悄悄少排
+    capacity = PhotoConfig.CATALOG.sheet_capacity(paper_size, spec)
+    if copies > capacity:
+        raise ValueError(f"copies={copies} exceeds the {capacity} photos that fit on one sheet")
+    sheet_format = "tif" if params.get("format") == "tif" else "jpg"
+
+    key = None
+    if cache is not None:
+        key = ResultCache.key("sheet", crop_key(params, data_digest(data), None),
+                              paper_size, copies, dpi, PhotoConfig.PRINT_CUT_MARGIN_MM,
+                              sheet_format)
+        cached = cache.read(key)
+        if cached is not None:
+            return cached
+
+    photo, _ = crop_entry(params, load_source_image(io.BytesIO(data)))
+    layout = PrintLayout(paper_size, spec)
+
+    # save_sheet 按文件扩展名选择格式，并遵守内存预算
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"sheet.{sheet_format}")
+        save_sheet(path, paper_size, layout.get_placements(photo, copies), dpi)
+        if key:
+            cache.store(key, path)
+        with open(path, "rb") as f:
+            return f.read()
+
+
+ROUTES = {
+    "/crop": render_crop_request,
+    "/sheet": render_sheet_request,
+}
+
+
+def content_type(path, params):
+    if path == "/crop":
+        return CONTENT_TYPES[export_profile(params.get("profile"))["format"]]
+    return "image/tiff" if params.get("format") == "tif" else "image/jpeg"
+
+
+class PhotoService:
+    def __init__(self, workers=None, max_queue=16, cache=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.cache = cache
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.semaphore = asyncio.Semaphore(self.workers)
+        self.started = time.time()
+        self.active = 0
+        self.pending = 0  # 已接受、尚未完成的渲染请求（处理中加排队）
+        self.counters = {"requests": 0, "completed": 0, "failed": 0, "rejected": 0}
+        self.render_seconds = 0.0
+
+    async def handle(self, reader, writer):
+        try:
+            status, content_type, body, headers = await self.dispatch(reader)
+        except Exception as e:
+            status, content_type, body, headers = self.error(500, e)
+        try:
+            writer.write(self.response(status, content_type, body, headers))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, reader):
+        try:
+            head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+            method, target, _ = head[0].split(" ", 2)
+            headers = {}
+            for line in head[1:]:
+                if ":" in line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length") or 0)
+        except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            return self.error(400, e)
+        self.counters["requests"] += 1
+
+        url = urlsplit(target)
+        if url.path == "/health":
+            return 200, "application/json", self.json({"status": "ok"}), {}
+        if url.path == "/metrics":
+            return 200, "application/json", self.json(self.metrics()), {}
+        if url.path not in ROUTES:
+            return self.error(404, f"Unknown path: {url.path}")
+        if method != "POST":
+            return self.error(405, f"{url.path} only accepts POST")
+
+        if length <= 0:
+            return self.error(400, "Missing image body")
+        if length > MAX_BODY_MB * 1024 * 1024:
+            return self.error(413, f"Image larger than {MAX_BODY_MB} MB")
+
+        # 排队已满时在读取请求体之前拒绝
+        if self.pending >= self.workers + self.max_queue:
+            self.counters["rejected"] += 1
+            # 读完并丢弃请求体，否则客户端还在发送时关闭连接会被重置，收不到 503
+            while length > 0:
+                chunk = await reader.read(min(length, 65536))
+                if not chunk:
+                    break
+                length -= len(chunk)
+            return self.error(503, "Server busy", {"Retry-After": "1"})
+
+        self.pending += 1
+        try:
+            data = await reader.readexactly(length)
+            params = dict(parse_qsl(url.query))
+            func = ROUTES[url.path]
+            body_type = content_type(url.path, params)
+
+            async with self.semaphore:
+                self.active += 1
+                started = time.perf_counter()
+                try:
+                    body = await asyncio.get_running_loop().run_in_executor(
+                        self.executor, func, params, data, self.cache
+                    )
+                finally:
+                    self.active -= 1
+                    self.render_seconds += time.perf_counter() - started
+        except (ValueError, UnidentifiedImageError, asyncio.IncompleteReadError) as e:
+            # 参数错误、请求体不是图片或比 Content-Length 短
+            self.counters["failed"] += 1
+            return self.error(400, e)
+        except Exception as e:
+            self.counters["failed"] += 1
+            return self.error(500, e)
+        finally:
+            self.pending -= 1
+        self.counters["completed"] += 1
+        return 200, body_type, body, {}
+
+    def metrics(self):
+        completed = self.counters["completed"]
+        return dict(
+            self.counters,
+            workers=self.workers,
+            active=self.active,
+            queued=self.pending - self.active,
+            max_queue=self.max_queue,
+            uptime_s=round(time.time() - self.started, 1),
+            average_render_ms=round(self.render_seconds / completed * 1000, 1) if completed else 0.0,
+        )
+
+    def error(self, status, message, headers=None):
+        return status, "application/json", self.json({"error": str(message)}), headers or {}
+
+    @staticmethod
+    def json(data):
+        return json.dumps(data).encode("utf-8")
+
+    @staticmethod
+    def response(status, content_type, body, headers):
+        lines = [
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            "Connection: close",
+        ]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+async def serve(host, port, workers=None, max_queue=16, cache=None):
+    service = PhotoService(workers, max_queue, cache)
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"Serving on http://{host}:{port} with {service.workers} workers", file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.executor.shutdown(cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local ID photo rendering service")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument("--max-queue", type=int, default=16,
+                        help="requests allowed to wait for a worker before returning 503")
+    parser.add_argument("--cache-dir", help="reuse rendered results from this directory")
+    parser.add_argument("--cache-mb", type=int, default=PhotoConfig.RESULT_CACHE_MB,
+                        help="maximum size of the result cache in MB")
+    args = parser.parse_args(argv)
+
+    cache = ResultCache(args.cache_dir, args.cache_mb) if args.cache_dir else None
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.max_queue, cache))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""按内容寻址的渲染结果磁盘缓存
+
+键是原图字节和全部渲染参数（包括 PhotoConfig 中的规格和纸张定义）的 sha256，
+同一张原图用同样的参数重新处理时直接复制缓存的结果，不再裁剪和排版。
+
+多个工作进程可以共用同一个缓存目录：结果先写入同目录下的临时文件，再用
+os.replace 原子地替换到位，读取方不会看到写了一半的文件；淘汰时文件可能已被
+其它进程删除，这类错误直接忽略。缓存总大小超过上限时按最近使用时间淘汰。
+
+每个进程记录上次扫描得到的总大小加上自己此后写入的字节数，只有估计值超过
+上限，或自己写入的量达到上限的 RESCAN_FRACTION 时才重新扫描目录，写入的
+开销与缓存中的文件数无关。淘汰到上限的 EVICT_TARGET 为止，留出余量。
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from photo_configs import PhotoConfig
+
+# 渲染算法改变、旧结果不再有效时递增
+RESULT_CACHE_VERSION = 1
+
+# 淘汰后保留的大小占上限的比例，避免缓存满后每次写入都要扫描目录
+EVICT_TARGET = 0.9
+
+# 本进程写入的量达到上限的这一比例时重新扫描，纠正其它进程写入和删除造成的偏差
+RESCAN_FRACTION = 1 / 16
+
+# 每个进程中各缓存目录的 [估计总大小, 上次扫描后本进程写入的字节数]。
+# ResultCache 会被传给工作进程，状态放在模块中，同一进程处理的多个任务共用
+_usage = {}
+
+
+def file_digest(path):
+    """返回文件内容的 sha256（十六进制）"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def data_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+    """缓存目录中每个结果一个文件，按键的前两位分子目录存放"""
+
+    def __init__(self, directory, max_mb=PhotoConfig.RESULT_CACHE_MB):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        """由可 JSON 序列化的参数计算缓存键，字典按键名排序"""
+        text = json.dumps([RESULT_CACHE_VERSION, *parts], sort_keys=True, default=str)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def read(self, key):
+        """返回缓存的字节，没有缓存时返回 None"""
+        try:
+            with open(self.path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self._touch(key)
+        return data
+
+    def fetch(self, key, dest_path):
+        """把缓存的结果复制到 dest_path，没有缓存时返回 False"""
+        try:
+            # 打开后即使被其它进程淘汰，已打开的文件仍可完整读取
+            with open(self.path(key), "rb") as src, open(dest_path, "wb") as dest:
+                shutil.copyfileobj(src, dest, 1024 * 1024)
+        except FileNotFoundError:
+            return False
+        self._touch(key)
+        return True
+
+    def write(self, key, data):
+        self._commit(key, lambda f: f.write(data))
+
+    def store(self, key, src_path):
+        """把已经生成的结果文件复制到缓存中"""
+        def copy(f):
+            with open(src_path, "rb") as src:
+                shutil.copyfileobj(src, f, 1024 * 1024)
+        self._commit(key, copy)
+
+    def _commit(self, key, write):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._account(size)
+
+    def _account(self, size):
+        """记录写入的字节数，估计的总大小可能超出上限时才扫描目录"""
+        usage = _usage.get(os.path.abspath(self.directory))
+        if usage is not None:
+            usage[0] += size
+            usage[1] += size
+        if (usage is None or usage[0] > self.max_bytes
+                or usage[1] > self.max_bytes * RESCAN_FRACTION):
+            self.evict()
+
+    def _touch(self, key):
+        # 修改时间即最近使用时间，用于淘汰
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        """扫描目录，总大小超过上限时删除最久未使用的结果，直到不超过上限的 EVICT_TARGET"""
+        files = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            for item in os.scandir(entry.path):
+                # 其它进程正在写的临时文件不计入也不删除
+                if item.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = item.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, item.path))
+                total += stat.st_size
+
+        if total > self.max_bytes:
+            files.sort()
+            for _, size, path in files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= self.max_bytes * EVICT_TARGET:
+                    break
+        _usage[os.path.abspath(self.directory)] = [total, 0]
@@ -0,0 +1,278 @@
+"""混合规格证件照的排版引擎
+
+把若干 (照片, 规格, 数量) 排到 PhotoConfig.PAPER_SIZES 中的打印纸上，每张纸尽量
+排满，支持旋转和裁切间距。排版结果只取决于纸张和各规格的数量，按
+(纸张, 规格多重集) 缓存，重复的订单可以直接复用。
+"""
+from functools import lru_cache
+
+from PIL import Image
+
+# 浮点比较的容差（毫米）
+EPSILON = 1e-6
+
+
+def print_size_mm(photo_spec):
+    """照片在打印纸上占用的尺寸 (宽, 高)
+
+    规格可以用 print_width_mm/print_height_mm 指定与成品尺寸不同的打印尺寸，
+    例如 2x2 英寸的美国护照照片按 50.8mm 排版，在 4x6 照相纸上正好排下 2 行 3 列。
+    """
+    return (photo_spec.get("print_width_mm", photo_spec["width_mm"]),
+            photo_spec.get("print_height_mm", photo_spec["height_mm"]))
+
+
+def _fits(size, width, height):
+    return size[0] <= width + EPSILON and size[1] <= height + EPSILON
+
+
+def _grid(x, y, width, height, cell_w, cell_h, rotated, limit):
+    """在矩形区域内按网格排列，返回 (x, y, 是否旋转) 列表"""
+    cols = int((width + EPSILON) // cell_w)
+    rows = int((height + EPSILON) // cell_h)
+    slots = []
+    for row in range(rows):
+        for col in range(cols):
+            if len(slots) >= limit:
+                return slots
+            slots.append((x + col * cell_w, y + row * cell_h, rotated))
+    return slots
+
+
+def _uniform_layout(width, height, cell_w, cell_h, allow_rotation, limit):
+    """单一尺寸的最优块状排列
+
+    比较横竖两种方向的整齐网格，以及把纸张切成两块、两块分别使用不同方向的
+    所有切法，取数量最多的一种。
+    """
+    best = _grid(0, 0, width, height, cell_w, cell_h, False, limit)
+    if not allow_rotation:
+        return best
+
+    orientations = [((cell_w, cell_h), False), ((cell_h, cell_w), True)]
+    for (a_w, a_h), a_rot in orientations:
+        for (b_w, b_h), b_rot in orientations:
+            # 竖直切分：左边 k 列用方向 a，右边剩余宽度用方向 b
+            for k in range(int((width + EPSILON) // a_w) + 1):
+                left = _grid(0, 0, k * a_w, height, a_w, a_h, a_rot, limit)
+                right = _grid(k * a_w, 0, width - k * a_w, height, b_w, b_h, b_rot,
+                              limit - len(left))
+                if len(left) + len(right) > len(best):
+                    best = left + right
+            # 水平切分：上边 k 行用方向 a，下边剩余高度用方向 b
+            for k in range(int((height + EPSILON) // a_h) + 1):
+                top = _grid(0, 0, width, k * a_h, a_w, a_h, a_rot, limit)
+                bottom = _grid(0, k * a_h, width, height - k * a_h, b_w, b_h, b_rot,
+                               limit - len(top))
+                if len(top) + len(bottom) > len(best):
+                    best = top + bottom
+    return best
+
+
+def _grid_count(width, height, cell_w, cell_h):
+    return int((width + EPSILON) // cell_w) * int((height + EPSILON) // cell_h)
+
+
+@lru_cache(maxsize=1024)
+def uniform_capacity(width, height, cell_w, cell_h, allow_rotation=True):
+    """_uniform_layout 能放下的照片数量，只计数不生成位置
+
+    与 _uniform_layout 比较同样的排列，结果按尺寸缓存；目录中的规格在加载时
+    已经算好，见 SpecCatalog.sheet_capacity。
+    """
+    best = _grid_count(width, height, cell_w, cell_h)
+    if not allow_rotation:
+        return best
+
+    orientations = [(cell_w, cell_h), (cell_h, cell_w)]
+    for a_w, a_h in orientations:
+        for b_w, b_h in orientations:
+            for k in range(int((width + EPSILON) // a_w) + 1):
+                count = (_grid_count(k * a_w, height, a_w, a_h)
+                         + _grid_count(width - k * a_w, height, b_w, b_h))
+                best = max(best, count)
+            for k in range(int((height + EPSILON) // a_h) + 1):
+                count = (_grid_count(width, k * a_h, a_w, a_h)
+                         + _grid_count(width, height - k * a_h, b_w, b_h))
+                best = max(best, count)
+    return best
+
+
+def _score(heuristic, free, w, h):
+    """MaxRects 的放置评分，越小越好"""
+    fx, fy, fw, fh = free
+    if heuristic == "short_side":
+        return (min(fw - w, fh - h), max(fw - w, fh - h))
+    if heuristic == "area":
+        return (fw * fh - w * h, min(fw - w, fh - h))
+    return (fy + h, fx)  # bottom_left
+
+
+def _maxrects(width, height, cells, allow_rotation, heuristic):
+    """MaxRects 排列，cells 为 (尺寸序号, 宽, 高) 列表，返回 (尺寸序号, x, y, 是否旋转) 列表"""
+    free_rects = [(0.0, 0.0, width, height)]
+    placed = []
+    for index, w, h in cells:
+        best = None
+        for rotated, (cw, ch) in ((False, (w, h)), (True, (h, w))):
+            if rotated and (not allow_rotation or w == h):
+                continue
+            for free in free_rects:
+                if _fits((cw, ch), free[2], free[3]):
+                    score = _score(heuristic, free, cw, ch)
+                    if best is None or score < best[0]:
+                        best = (score, free[0], free[1], cw, ch, rotated)
+        if best is None:
+            continue
+
+        _, x, y, cw, ch, rotated = best
+        placed.append((index, x, y, rotated))
+
+        # 与新放置矩形相交的空闲矩形拆分成最多四个
+        new_free = []
+        for fx, fy, fw, fh in free_rects:
+            if x >= fx + fw - EPSILON or x + cw <= fx + EPSILON \
+                    or y >= fy + fh - EPSILON or y + ch <= fy + EPSILON:
+                new_free.append((fx, fy, fw, fh))
+                continue
+            if x > fx + EPSILON:
+                new_free.append((fx, fy, x - fx, fh))
+            if x + cw < fx + fw - EPSILON:
+                new_free.append((x + cw, fy, fx + fw - x - cw, fh))
+            if y > fy + EPSILON:
+                new_free.append((fx, fy, fw, y - fy))
+            if y + ch < fy + fh - EPSILON:
+                new_free.append((fx, y + ch, fw, fy + fh - y - ch))
+
+        # 去掉被其它空闲矩形完全包含的矩形
+        free_rects = [
+            a for i, a in enumerate(new_free)
+            if not any(
+                j != i and b[0] <= a[0] + EPSILON and b[1] <= a[1] + EPSILON
+                and a[0] + a[2] <= b[0] + b[2] + EPSILON and a[1] + a[3] <= b[1] + b[3] + EPSILON
+                and (b != a or j < i)
+                for j, b in enumerate(new_free)
+            )
+        ]
+    return placed
+
+
+def _fill_sheet(width, height, sizes, remaining, allow_rotation):
+    """在一张纸上尽量多地放置剩余照片"""
+    candidates = []
+
+    kinds = [i for i, count in enumerate(remaining) if count]
+    if len(kinds) == 1:
+        index = kinds[0]
+        w, h = sizes[index]
+        slots = _uniform_layout(width, height, w, h, allow_rotation, remaining[index])
+        candidates.append([(index, x, y, rotated) for x, y, rotated in slots])
+
+    cells = [(i, sizes[i][0], sizes[i][1]) for i in kinds for _ in range(remaining[i])]
+    orders = [
+        lambda c: -c[1] * c[2],        # 面积从大到小
+        lambda c: -max(c[1], c[2]),    # 长边从大到小
+        lambda c: -(c[1] + c[2]),      # 周长从大到小
+    ]
+    for order in orders:
+        ordered = sorted(cells, key=order)
+        for heuristic in ("short_side", "area", "bottom_left"):
+            candidates.append(_maxrects(width, height, ordered, allow_rotation, heuristic))
+
+    def covered_area(slots):
+        return sum(sizes[index][0] * sizes[index][1] for index, _, _, _ in slots)
+
+    return max(candidates, key=lambda slots: (covered_area(slots), len(slots)))
+
+
+@lru_cache(maxsize=256)
+def solve_layout(paper_width, paper_height, demand, cut_margin=0.0, edge_margin=0.0,
+                 allow_rotation=True):
+    """计算排版，结果按 (纸张, 规格多重集, 间距) 缓存
+
+    demand 为 ((宽, 高), 数量) 组成的元组。返回每张纸的照片位置，位置为
+    (尺寸序号, x_mm, y_mm, 是否旋转)，尺寸序号对应 demand 中的顺序。
+    """
+    sizes = [(w + cut_margin, h + cut_margin) for (w, h), _ in demand]
+    remaining = [count for _, count in demand]
+
+    # 每张照片右下方多留一个裁切间距，可用区域相应加大
+    usable_w = paper_width - 2 * edge_margin + cut_margin
+    usable_h = paper_height - 2 * edge_margin + cut_margin
+    for (w, h), count in zip(sizes, remaining):
+        if count and not (_fits((w, h), usable_w, usable_h)
+                          or (allow_rotation and _fits((h, w), usable_w, usable_h))):
+            raise ValueError(f"{w - cut_margin}x{h - cut_margin}mm photo does not fit on the paper")
+
+    sheets = []
+    while any(remaining):
+        slots = _fill_sheet(usable_w, usable_h, sizes, remaining, allow_rotation)
+        for index, _, _, _ in slots:
+            remaining[index] -= 1
+
+        # 整体居中
+        right = max(x + (sizes[i][1] if rotated else sizes[i][0]) for i, x, _, rotated in slots)
+        bottom = max(y + (sizes[i][0] if rotated else sizes[i][1]) for i, _, y, rotated in slots)
+        offset_x = edge_margin + (usable_w - right) / 2
+        offset_y = edge_margin + (usable_h - bottom) / 2
+        sheets.append(tuple(
+            (index, offset_x + x, offset_y + y, rotated) for index, x, y, rotated in slots
+        ))
+    return tuple(sheets)
+
+
+class SheetPacker:
+    """把多种规格的照片排到指定的打印纸上"""
+
+    def __init__(self, paper_size, cut_margin_mm=0.0, edge_margin_mm=0.0, allow_rotation=True):
+        self.paper_size = paper_size
+        self.cut_margin_mm = cut_margin_mm
+        self.edge_margin_mm = edge_margin_mm
+        self.allow_rotation = allow_rotation
+
+    def pack(self, items):
+        """items 为 (照片, 规格, 数量) 列表
+
+        返回每张打印纸的位置列表，元素为 (照片, (x_mm, y_mm), (宽_mm, 高_mm))，
+        可以直接传给 compose_sheet。旋转的照片已经转为横竖互换后的图像。
+        """
+        # 相同打印尺寸的照片共用一种位置，按出现顺序依次填入
+        queues = {}
+        for photo, spec, count in items:
+            size = print_size_mm(spec)
+            queues.setdefault(size, []).extend([photo] * int(count))
+        demand = tuple(sorted((size, len(photos)) for size, photos in queues.items()))
+
+        layout = solve_layout(
+            self.paper_size["width_mm"], self.paper_size["height_mm"], demand,
+            self.cut_margin_mm, self.edge_margin_mm, self.allow_rotation
+        )
+
+        positions = {size: 0 for size in queues}
+        rotated_photos = {}
+        sheets = []
+        for slots in layout:
+            placements = []
+            for index, x, y, rotated in slots:
+                size = demand[index][0]
+                photo = queues[size][positions[size]]
+                positions[size] += 1
+                width, height = size
+                if rotated:
+                    # 同一张照片只旋转一次
+                    key = id(photo)
+                    if key not in rotated_photos:
+                        rotated_photos[key] = photo.transpose(Image.Transpose.ROTATE_90)
+                    photo = rotated_photos[key]
+                    width, height = height, width
+                placements.append((photo, (x, y), (width, height)))
+            sheets.append(placements)
+        return sheets
+
+    def capacity(self, spec):
+        """一张纸最多能放多少张该规格的照片"""
+        width, height = print_size_mm(spec)
+        usable_w = self.paper_size["width_mm"] - 2 * self.edge_margin_mm + self.cut_margin_mm
+        usable_h = self.paper_size["height_mm"] - 2 * self.edge_margin_mm + self.cut_margin_mm
+        return uniform_capacity(usable_w, usable_h, width + self.cut_margin_mm,
+                                height + self.cut_margin_mm, self.allow_rotation)
@@ -0,0 +1,238 @@
+"""证件照规格目录
+
+规格和打印纸以 JSON 文件保存在 catalog/ 目录下：
+    catalog/papers.json          打印纸列表
+    catalog/specs/<国家代码>.json  一个国家的全部规格，国家代码为 ISO 3166 两位大写字母
+
+程序启动时加载并校验一次，之后不再读取文件。加载时同时计算每个规格的像素
+尺寸、辅助线相对裁剪框底边的像素偏移，以及每种打印尺寸在每种打印纸上排满时
+的数量（PrintLayout 和批处理直接查表），并按国家、证件类型、毫米尺寸和像素
+尺寸建立索引。照片在纸上的具体位置仍在排版时计算，由 solve_layout 缓存。PhotoConfig 的
+SPECIFICATIONS 和 PAPER_SIZES 由目录生成，规格的字段与原来相同：
+
+    width_mm, height_mm   成品尺寸
+    print_width_mm,       可选，排版时使用的打印尺寸，与成品尺寸不同时填写
+    print_height_mm
+    dpi, bg_color, description, guide_lines
+    country, document     国家代码和证件类型（passport、visa、id_card 等）
+"""
+import json
+import os
+import re
+
+from sheet_packing import SheetPacker, print_size_mm
+
+CATALOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog")
+
+GUIDE_KEYS = ("eyes_position_min", "eyes_position_max", "head_size_min", "head_size_max")
+
+COUNTRY_CODE = re.compile(r"^[A-Z]{2}$")
+
+
+class CatalogError(ValueError):
+    """目录文件缺少字段或数值不合理"""
+
+
+def spec_pixel_size(spec):
+    """证件照规格对应的像素尺寸 (宽, 高)"""
+    return (int(spec["width_mm"] * spec["dpi"] / 25.4),
+            int(spec["height_mm"] * spec["dpi"] / 25.4))
+
+
+def guide_offsets(spec):
+    """辅助线相对裁剪框底边的像素偏移，画布上的 y 坐标为底边 y 加偏移
+
+    返回 {"eyes": (最低, 最高), "head": (头顶最大, 头顶最小, 下巴最小, 下巴最大)}。
+    头部范围以两条眼睛线的中点为基准，头顶在其上 40%，下巴在其下 60%。
+    """
+    mm_to_px = spec["dpi"] / 25.4
+    guide = spec["guide_lines"]
+    eyes = (-int(guide["eyes_position_min"] * mm_to_px),
+            -int(guide["eyes_position_max"] * mm_to_px))
+    center = (eyes[0] + eyes[1]) / 2
+    head_min = guide["head_size_min"] * mm_to_px
+    head_max = guide["head_size_max"] * mm_to_px
+    head = (center - int(head_max * 0.4), center - int(head_min * 0.4),
+            center + int(head_min * 0.6), center + int(head_max * 0.6))
+    return {"eyes": eyes, "head": head}
+
+
+def _fail(path, name, message):
+    raise CatalogError(f"{path}: {name}: {message}")
+
+
+def _positive(path, name, record, key, integer=False):
+    value = record.get(key)
+    kinds = int if integer else (int, float)
+    if isinstance(value, bool) or not isinstance(value, kinds) or value <= 0:
+        _fail(path, name, f"{key} must be a positive {'integer' if integer else 'number'}")
+    return value
+
+
+def _text(path, name, record, key):
+    value = record.get(key)
+    if not isinstance(value, str) or not value.strip():
+        _fail(path, name, f"{key} must be a non-empty string")
+    return value
+
+
+def _read(path, key):
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise CatalogError(f"{path}: {e}") from e
+    if not isinstance(data, dict) or not isinstance(data.get(key), list):
+        raise CatalogError(f"{path}: expected an object with a '{key}' list")
+    return data
+
+
+def validate_paper(path, record):
+    """校验一种打印纸，返回 (名称, 配置字典)"""
+    if not isinstance(record, dict):
+        raise CatalogError(f"{path}: each paper must be an object")
+    name = _text(path, "paper", record, "name")
+    paper = {
+        "width_mm": _positive(path, name, record, "width_mm"),
+        "height_mm": _positive(path, name, record, "height_mm"),
+        "dpi": _positive(path, name, record, "dpi", integer=True),
+        "description": _text(path, name, record, "description"),
+    }
+    return name, paper
+
+
+def validate_spec(path, country, record):
+    """校验一个规格，返回 (名称, 规格字典)"""
+    if not isinstance(record, dict):
+        raise CatalogError(f"{path}: each spec must be an object")
+    name = _text(path, "spec", record, "name")
+    spec = {
+        "width_mm": _positive(path, name, record, "width_mm"),
+        "height_mm": _positive(path, name, record, "height_mm"),
+    }
+    has_print = ("print_width_mm" in record, "print_height_mm" in record)
+    if any(has_print):
+        if not all(has_print):
+            _fail(path, name, "print_width_mm and print_height_mm must be given together")
+        spec["print_width_mm"] = _positive(path, name, record, "print_width_mm")
+        spec["print_height_mm"] = _positive(path, name, record, "print_height_mm")
+
+    spec["dpi"] = _positive(path, name, record, "dpi", integer=True)
+    bg_color = record.get("bg_color")
+    if (not isinstance(bg_color, list) or len(bg_color) != 3
+            or not all(isinstance(v, int) and not isinstance(v, bool) and 0 <= v <= 255
+                       for v in bg_color)):
+        _fail(path, name, "bg_color must be three integers between 0 and 255")
+    spec["bg_color"] = tuple(bg_color)
+    spec["description"] = _text(path, name, record, "description")
+
+    guide = record.get("guide_lines")
+    if not isinstance(guide, dict):
+        _fail(path, name, "guide_lines must be an object")
+    spec["guide_lines"] = {key: _positive(path, name, guide, key) for key in GUIDE_KEYS}
+    for low, high in (("eyes_position_min", "eyes_position_max"),
+                      ("head_size_min", "head_size_max")):
+        if guide[low] > guide[high]:
+            _fail(path, name, f"{low} is greater than {high}")
+    if guide["eyes_position_max"] >= spec["height_mm"]:
+        _fail(path, name, "eyes_position_max must be below the top of the photo")
+    if guide["head_size_max"] > spec["height_mm"]:
+        _fail(path, name, "head_size_max is taller than the photo")
+
+    spec["country"] = country
+    spec["document"] = _text(path, name, record, "document")
+    return name, spec
+
+
+class SpecCatalog:
+    """加载后的规格目录，规格和纸张按文件中的顺序排列"""
+
+    def __init__(self, specs, papers, cut_margin_mm=0.0):
+        self.specs = specs
+        self.papers = papers
+        self.geometry = {}
+        self.by_country = {}
+        self.by_document = {}
+        self.by_size = {}
+        self.by_pixel_size = {}
+        for name, spec in specs.items():
+            pixel_size = spec_pixel_size(spec)
+            self.geometry[name] = {"pixel_size": pixel_size, "guide_offsets": guide_offsets(spec)}
+            self.by_country.setdefault(spec["country"], []).append(name)
+            self.by_document.setdefault(spec["document"], []).append(name)
+            self.by_size.setdefault((spec["width_mm"], spec["height_mm"]), []).append(name)
+            self.by_pixel_size.setdefault(pixel_size, []).append(name)
+        self.max_pixel_side = max(max(g["pixel_size"]) for g in self.geometry.values())
+
+        # 每种打印尺寸在每种纸上排满时的数量，按 (纸张尺寸, 打印尺寸) 索引，
+        # 许多国家的规格尺寸相同，只计算一次
+        self.cut_margin_mm = cut_margin_mm
+        self.capacity = {}
+        print_sizes = {print_size_mm(spec): spec for spec in specs.values()}
+        for paper in papers.values():
+            packer = SheetPacker(paper, cut_margin_mm)
+            for size, spec in print_sizes.items():
+                self.capacity[(paper["width_mm"], paper["height_mm"]), size] = \
+                    packer.capacity(spec)
+
+    def sheet_capacity(self, paper_size, spec, cut_margin_mm=None):
+        """一张纸最多能放多少张该规格的照片，目录外的尺寸或其它裁切间距时现场计算"""
+        if cut_margin_mm is None:
+            cut_margin_mm = self.cut_margin_mm
+        key = (paper_size["width_mm"], paper_size["height_mm"]), print_size_mm(spec)
+        if cut_margin_mm == self.cut_margin_mm and key in self.capacity:
+            return self.capacity[key]
+        return SheetPacker(paper_size, cut_margin_mm).capacity(spec)
+
+    def countries(self):
+        return sorted(self.by_country)
+
+    def documents(self):
+        return sorted(self.by_document)
+
+    def find(self, country=None, document=None, size_mm=None):
+        """按国家代码、证件类型和成品尺寸 (宽, 高) 查找规格名，未指定的条件不限制"""
+        names = self.specs.keys()
+        for index, key in ((self.by_country, country and country.upper()),
+                           (self.by_document, document),
+                           (self.by_size, size_mm and tuple(size_mm))):
+            if key is not None:
+                names = [name for name in names if name in index.get(key, ())]
+        return list(names)
+
+    def spec_for_pixel_size(self, size):
+        """按成品像素尺寸查找规格名，找不到时返回 None；多个规格同尺寸时返回第一个"""
+        names = self.by_pixel_size.get(tuple(size))
+        return names[0] if names else None
+
+
+def load_catalog(directory=CATALOG_DIR, cut_margin_mm=0.0):
+    """加载并校验目录，任何错误都抛出 CatalogError"""
+    papers_path = os.path.join(directory, "papers.json")
+    papers = {}
+    for record in _read(papers_path, "papers")["papers"]:
+        name, paper = validate_paper(papers_path, record)
+        if name in papers:
+            _fail(papers_path, name, "duplicate paper name")
+        papers[name] = paper
+
+    specs_dir = os.path.join(directory, "specs")
+    specs = {}
+    for filename in sorted(os.listdir(specs_dir)):
+        if not filename.endswith(".json"):
+            continue
+        path = os.path.join(specs_dir, filename)
+        data = _read(path, "specs")
+        country = data.get("country")
+        if not isinstance(country, str) or not COUNTRY_CODE.match(country) \
+                or filename != f"{country}.json":
+            raise CatalogError(f"{path}: country must be a two-letter code matching the file name")
+        for record in data["specs"]:
+            name, spec = validate_spec(path, country, record)
+            if name in specs:
+                _fail(path, name, "duplicate spec name")
+            specs[name] = spec
+
+    if not papers or not specs:
+        raise CatalogError(f"{directory}: catalog needs at least one paper and one spec")
+    return SpecCatalog(specs, papers, cut_margin_mm)
@@ -0,0 +1,157 @@
+"""各阶段耗时的轻量级统计
+
+设置环境变量 ID_PHOTO_TELEMETRY 后启用：
+    ID_PHOTO_TELEMETRY=1            记录各阶段耗时，编辑器状态栏显示帧时间
+    ID_PHOTO_TELEMETRY=trace.json   同时在退出时写出 Chrome trace 格式的 JSON，
+                                    可在 chrome://tracing 或 Perfetto 中打开，
+                                    otherData 中包含各阶段汇总和帧时间直方图
+
+未启用时 span() 返回同一个空的上下文管理器，几乎没有开销。
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import nullcontext
+
+_SETTING = os.environ.get("ID_PHOTO_TELEMETRY", "").strip()
+ENABLED = _SETTING not in ("", "0")
+TRACE_PATH = _SETTING if ENABLED and _SETTING != "1" else None
+
+# 保留的最近事件数，超出后丢弃最早的事件
+MAX_EVENTS = 100_000
+
+# 这些阶段的耗时同时计入帧时间直方图
+FRAME_SPANS = {"show_image"}
+
+_NO_SPAN = nullcontext()
+_started = time.perf_counter()
+_events = deque(maxlen=MAX_EVENTS)
+_stats = {}
+_lock = threading.Lock()
+
+
+class FrameTimes:
+    """最近 window 帧的耗时，按毫秒分桶统计"""
+
+    # 桶的上界（毫秒），16.7/33.3 对应 60/30 帧每秒
+    BUCKETS_MS = (4, 8, 16.7, 33.3, 50, 100, 250)
+
+    def __init__(self, window=240):
+        self.durations = deque(maxlen=window)
+
+    def add(self, seconds):
+        self.durations.append(seconds * 1000)
+
+    def percentile(self, fraction):
+        if not self.durations:
+            return 0.0
+        ordered = sorted(self.durations)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def histogram(self):
+        """返回 {桶上界: 帧数}，最后一个桶为 "inf" """
+        labels = [str(bound) for bound in self.BUCKETS_MS] + ["inf"]
+        counts = [0] * len(labels)
+        for duration in self.durations:
+            counts[bisect_left(self.BUCKETS_MS, duration)] += 1
+        return dict(zip(labels, counts))
+
+    def summary(self):
+        if not self.durations:
+            return "no frames"
+        return (f"frame {self.durations[-1]:.1f} ms, p50 {self.percentile(0.5):.1f} ms, "
+                f"p95 {self.percentile(0.95):.1f} ms ({len(self.durations)} frames)")
+
+
+frame_times = FrameTimes()
+
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        _events.append((self.name, self.start, duration, threading.get_ident(), self.args))
+        with _lock:
+            stats = _stats.setdefault(self.name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+        if self.name in FRAME_SPANS:
+            frame_times.add(duration)
+        return False
+
+
+def span(name, **args):
+    """记录一个阶段的耗时：with span("resize"): ..."""
+    if not ENABLED:
+        return _NO_SPAN
+    return _Span(name, args)
+
+
+def traced(name, func):
+    """返回在 span(name) 中调用 func 的函数，未启用时直接返回 func"""
+    if not ENABLED:
+        return func
+
+    def wrapper(*args, **kwargs):
+        with _Span(name, {}):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def summary():
+    """各阶段的次数、总耗时、平均和最大耗时（毫秒）"""
+    with _lock:
+        items = sorted(_stats.items())
+    return {
+        name: {
+            "count": count,
+            "total_ms": round(total * 1000, 3),
+            "mean_ms": round(total / count * 1000, 3),
+            "max_ms": round(longest * 1000, 3),
+        }
+        for name, (count, total, longest) in items
+    }
+
+
+def export_trace(path):
+    """写出 Chrome trace 格式的 JSON"""
+    events = [
+        {
+            "name": name,
+            "ph": "X",
+            "ts": round((start - _started) * 1e6, 1),
+            "dur": round(duration * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": thread,
+            "args": args,
+        }
+        for name, start, duration, thread, args in list(_events)
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "stages": summary(),
+                "frame_histogram_ms": frame_times.histogram(),
+                "frame_summary": frame_times.summary(),
+            },
+        }, f, default=str)
+
+
+if TRACE_PATH:
+    atexit.register(export_trace, TRACE_PATH)
@@ -0,0 +1,76 @@
+"""parallel_resize.resize 与 Image.resize 逐位相同
+
+强制使用多个线程、关闭像素数阈值并缩小分块，让很小的图像也走分块路径。
+"""
+import io
+import random
+
+import pytest
+from PIL import Image
+
+import parallel_resize
+
+FILTERS = [f for f in parallel_resize.FILTER_SUPPORT if f != Image.Resampling.NEAREST]
+
+
+@pytest.fixture
+def tiled(monkeypatch):
+    monkeypatch.setattr(parallel_resize.os, "cpu_count", lambda: 7)
+    monkeypatch.setattr(parallel_resize, "PARALLEL_MIN_PIXELS", 0)
+    monkeypatch.setattr(parallel_resize, "MIN_TILE", 5)
+
+
+def noise(mode, size, seed):
+    return Image.frombytes(mode, size, random.Random(seed).randbytes(
+        size[0] * size[1] * len(mode)))
+
+
+def random_box(rng, size):
+    if rng.random() < 0.3:
+        return None
+    x0 = rng.uniform(0, size[0] - 1)
+    y0 = rng.uniform(0, size[1] - 1)
+    return (x0, y0, rng.uniform(x0 + 0.5, size[0]), rng.uniform(y0 + 0.5, size[1]))
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_matches_image_resize(tiled, seed):
+    rng = random.Random(seed)
+    image = noise(rng.choice(["RGB", "L"]), (rng.randint(1, 160), rng.randint(1, 160)), seed)
+    for _ in range(10):
+        size = (rng.randint(1, 200), rng.randint(1, 200))
+        box = random_box(rng, image.size)
+        resample = rng.choice(FILTERS)
+        expected = image.resize(size, resample, box)
+        assert parallel_resize.resize(image, size, resample, box).tobytes() == expected.tobytes()
+
+
+@pytest.mark.parametrize("resample", FILTERS)
+def test_single_pass(tiled, resample):
+    image = noise("RGB", (90, 70), 1)
+    for size, box in [((40, 70), None), ((90, 33), None), ((90, 70), (10, 0, 80, 70)),
+                      ((90, 70), (0, 5.5, 90, 60))]:
+        expected = image.resize(size, resample, box)
+        assert parallel_resize.resize(image, size, resample, box).tobytes() == expected.tobytes()
+
+
+def test_fallback_modes(tiled):
+    lanczos = Image.Resampling.LANCZOS
+    image = noise("RGBA", (50, 40), 2)
+    assert (parallel_resize.resize(image, (20, 30), lanczos).tobytes()
+            == image.resize((20, 30), lanczos).tobytes())
+    image = noise("RGB", (50, 40), 3)
+    nearest = Image.Resampling.NEAREST
+    assert (parallel_resize.resize(image, (77, 13), nearest).tobytes()
+            == image.resize((77, 13), nearest).tobytes())
+
+
+def test_lazily_decoded_image(tiled):
+    buffer = io.BytesIO()
+    noise("RGB", (300, 200), 4).save(buffer, "JPEG")
+    box = (10, 10, 290, 190)
+    expected = Image.open(io.BytesIO(buffer.getvalue())).resize(
+        (120, 80), Image.Resampling.LANCZOS, box)
+    image = Image.open(io.BytesIO(buffer.getvalue()))
+    result = parallel_resize.resize(image, (120, 80), Image.Resampling.LANCZOS, box)
+    assert result.tobytes() == expected.tobytes()
@@ -0,0 +1,92 @@
+"""按水平条带写出 RGB TIFF
+
+条带逐条压缩写入文件，整张图像不需要同时存在于内存中，适合高 DPI 的大幅
+打印排版。每个条带使用 Deflate（zlib）压缩，Pillow、Photoshop 和常见的打印
+软件都可以直接打开。
+"""
+import struct
+import zlib
+
+# TIFF 字段类型
+SHORT = 3
+LONG = 4
+RATIONAL = 5
+
+_TYPE_FORMATS = {SHORT: "H", LONG: "I"}
+
+
+def _ifd_entry(tag, field_type, values):
+    """返回 (tag, 类型, 数量, 打包后的数据)"""
+    if field_type == RATIONAL:
+        # 有理数由分子、分母两个 LONG 组成
+        count = len(values) // 2
+        fmt = "<" + "I" * len(values)
+    else:
+        count = len(values)
+        fmt = "<" + _TYPE_FORMATS[field_type] * count
+    return tag, field_type, count, struct.pack(fmt, *values)
+
+
+def write_tiff(path, size, strips, rows_per_strip, dpi=300, compress_level=6):
+    """把依次生成的 RGB 条带写成一个 TIFF 文件
+
+    strips 为可迭代的 PIL Image，除最后一个外高度都必须等于 rows_per_strip，
+    宽度必须等于 size[0]。
+    """
+    width, height = size
+    offsets = []
+    byte_counts = []
+
+    with open(path, "wb") as f:
+        # 文件头，IFD 的位置最后再回填
+        f.write(b"II*\x00\x00\x00\x00\x00")
+
+        rows = 0
+        for strip in strips:
+            if strip.width != width or strip.mode != "RGB":
+                raise ValueError("strip does not match the image size or mode")
+            data = zlib.compress(strip.tobytes(), compress_level)
+            offsets.append(f.tell())
+            byte_counts.append(len(data))
+            f.write(data)
+            rows += strip.height
+        if rows != height:
+            raise ValueError(f"strips contain {rows} rows, expected {height}")
+
+        entries = [
+            _ifd_entry(256, LONG, [width]),            # ImageWidth
+            _ifd_entry(257, LONG, [height]),           # ImageLength
+            _ifd_entry(258, SHORT, [8, 8, 8]),         # BitsPerSample
+            _ifd_entry(259, SHORT, [8]),               # Compression: Deflate
+            _ifd_entry(262, SHORT, [2]),               # PhotometricInterpretation: RGB
+            _ifd_entry(273, LONG, offsets),            # StripOffsets
+            _ifd_entry(277, SHORT, [3]),               # SamplesPerPixel
+            _ifd_entry(278, LONG, [rows_per_strip]),   # RowsPerStrip
+            _ifd_entry(279, LONG, byte_counts),        # StripByteCounts
+            _ifd_entry(282, RATIONAL, [int(dpi), 1]),  # XResolution
+            _ifd_entry(283, RATIONAL, [int(dpi), 1]),  # YResolution
+            _ifd_entry(284, SHORT, [1]),               # PlanarConfiguration: chunky
+            _ifd_entry(296, SHORT, [2]),               # ResolutionUnit: inch
+        ]
+
+        # 超过 4 字节的值放在 IFD 之后
+        ifd_offset = f.tell()
+        ifd_offset += ifd_offset % 2  # IFD 需要字对齐
+        value_offset = ifd_offset + 2 + 12 * len(entries) + 4
+        ifd = struct.pack("<H", len(entries))
+        extra = b""
+        for tag, field_type, count, data in entries:
+            if len(data) <= 4:
+                ifd += struct.pack("<HHI", tag, field_type, count) + data.ljust(4, b"\x00")
+            else:
+                ifd += struct.pack("<HHII", tag, field_type, count, value_offset + len(extra))
+                extra += data
+                extra += b"\x00" * (len(extra) % 2)
+        ifd += struct.pack("<I", 0)  # 没有下一个 IFD
+
+        f.seek(0, 2)
+        f.write(b"\x00" * (ifd_offset - f.tell()))
+        f.write(ifd + extra)
+
+        f.seek(4)
+        f.write(struct.pack("<I", ifd_offset))